@@ -0,0 +1,55 @@
+"""
+Sync vs async serving benchmark
+
+Starts the Flask app under gunicorn sync workers and the ASGI app
+(service.asgi) under uvicorn, each with the same number of worker
+processes and the same database, then drives both with many concurrent
+clients and reports requests/sec and latency percentiles.
+
+The Customer cache is turned off in both servers so every request reaches
+the database. SQLite works as a local stand-in; point DATABASE_URI at a
+PostgreSQL instance to see the effect of real network waits.
+
+Usage:
+  DATABASE_URI=sqlite:////tmp/customers_bench.db python -m benchmarks.asgi_bench \\
+      [--workers 1] [--concurrency 64] [--duration 10] [--customers 1000] [--workload get]
+"""
+import argparse
+import json
+import random
+from benchmarks.harness import SERVERS, run_scenario, seed, serve
+
+
+def run(workers, concurrency, duration, customers, workload, port=8181):
+    """Benchmarks each server in turn against the same seeded database"""
+    ids = [customer["id"] for customer in seed(customers)]
+    if workload == "get":
+        def make_request():
+            return "GET", f"/api/customers/{random.choice(ids)}", None, None
+    else:
+        def make_request():
+            return "GET", "/api/customers", {"limit": 20}, None
+
+    results = {}
+    for name in SERVERS:
+        with serve(name, port, workers, {"CUSTOMER_CACHE_SIZE": "0"}) as base_url:
+            results[name] = run_scenario(base_url, make_request, concurrency, duration)
+    return results
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes per server")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to drive each server")
+    parser.add_argument("--customers", type=int, default=1000, help="Customers to seed")
+    parser.add_argument("--workload", choices=["get", "list"], default="get",
+                        help="GET single Customers by id or pages of 20")
+    args = parser.parse_args()
+    results = run(args.workers, args.concurrency, args.duration, args.customers, args.workload)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Load generation helpers shared by the HTTP benchmarks
+
+The database is seeded with CustomerFactory through the models, a server
+is started as a subprocess on the same database and an asyncio httpx
+client drives it at a fixed concurrency.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+import httpx
+from service import app
+from service.models import Customer, db
+from tests.factories import CustomerFactory
+
+# Commands that start each kind of server on a port with some workers
+SERVERS = {
+    # Explicitly one thread per worker: gunicorn.conf.py defaults to gthread
+    "sync": lambda port, workers: [
+        sys.executable, "-m", "gunicorn", "--workers", str(workers), "--worker-class", "sync",
+        "--threads", "1", "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "service:app",
+    ],
+    "async": lambda port, workers: [
+        sys.executable, "-m", "uvicorn", "--workers", str(workers), "--port", str(port),
+        "--log-level", "warning", "--no-access-log", "service.asgi:app",
+    ],
+}
+
+
+def seed(count):
+    """
+    Replaces every Customer in the database with count new ones
+
+    Returns:
+        list: the new Customers as dictionaries, in id order
+    """
+    Customer.create_schema(app)
+    with app.app_context():
+        db.session.query(Customer).delete()
+        db.session.commit()
+        customers = []
+        for number in range(count):
+            customer = CustomerFactory(acc_active=True)
+            # Faker repeats emails often enough to collide in a few thousand
+            customer.email = f"{number}.{customer.email}"
+            customer.normalize()
+            customers.append(customer)
+        Customer.create_many(customers)
+        return [customer.serialize() for customer in Customer.query.order_by(Customer.id)]
+
+
+def percentile(ordered, fraction):
+    """Returns a percentile of an ordered list of latencies"""
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    """Returns the throughput and latency percentiles of a run"""
+    latencies = sorted(latencies) or [0.0]
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def wait_until_up(base_url, timeout=30.0):
+    """Polls the health endpoint until the server answers"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{base_url}/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not start")
+
+
+@contextmanager
+def serve(name, port, workers, env=None):
+    """Runs one of the SERVERS on a port until the block exits"""
+    base_url = f"http://127.0.0.1:{port}"
+    with subprocess.Popen(SERVERS[name](port, workers), env=dict(os.environ, **(env or {}))) as server:
+        try:
+            asyncio.run(wait_until_up(base_url))
+            yield base_url
+        finally:
+            server.terminate()
+            server.wait()
+
+
+async def drive(base_url, make_request, concurrency, duration):
+    """
+    Sends requests from concurrency clients in a loop for duration seconds
+
+    Args:
+        base_url (str): the server to drive
+        make_request (callable): returns the (method, path, params, body)
+            of the next request
+        concurrency (int): the number of clients sending requests at once
+        duration (float): the number of seconds to keep sending
+
+    Returns:
+        dict: the summary of the run, see summarize
+    """
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        deadline = time.monotonic() + duration
+
+        async def client_loop():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                method, path, params, body = make_request()
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, params=params, json=body)
+                    ok = response.is_success
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                errors += not ok
+
+        started = time.monotonic()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return summarize(latencies, errors, elapsed)
+
+
+def run_scenario(base_url, make_request, concurrency, duration, warmup=1.0):
+    """Warms a server up with a scenario and then measures it"""
+    if warmup:
+        asyncio.run(drive(base_url, make_request, concurrency, warmup))
+    return asyncio.run(drive(base_url, make_request, concurrency, duration))
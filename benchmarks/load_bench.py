@@ -0,0 +1,189 @@
+"""
+Endpoint load benchmark
+
+Seeds the database with CustomerFactory, starts the service and drives
+every endpoint in turn at a fixed concurrency: get, list, list by each
+filter, search, create, update, activate/deactivate and delete. Throughput and
+p50/p95/p99 latency of each scenario are reported as JSON.
+
+With --baseline the results are compared against an earlier run and the
+command exits with status 1 when a scenario lost more throughput, or
+gained more p95/p99 latency, than --tolerance allows.
+
+Seeding DELETES every Customer first, so point DATABASE_URI at a database
+used only for benchmarks.
+
+Usage:
+  DATABASE_URI=sqlite:////tmp/customers_bench.db python -m benchmarks.load_bench \\
+      [--customers 1000] [--concurrency 16] [--duration 5] [--server sync] \\
+      [--scenarios get,create] [--output results.json] \\
+      [--baseline benchmarks/baseline.json --tolerance 0.2]
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import uuid
+from benchmarks.harness import SERVERS, run_scenario, seed, serve
+from service.models import Customer
+from tests.factories import CustomerFactory
+
+BASE_URL = "/api/customers"
+
+# Metrics compared against a baseline and whether higher values are better
+COMPARED = {"requests_per_sec": True, "p95_ms": False, "p99_ms": False}
+
+
+def search_by_prefix(customers):
+    """Returns a factory of searches for the first letters of a name, email or city"""
+    def make_request():
+        text = random.choice(customers)[random.choice(Customer.SEARCH_COLUMNS)]
+        return "GET", f"{BASE_URL}/search", {"q": text[:random.randint(3, 5)]}, None
+    return make_request
+
+
+def patch_phone(ids):
+    """Returns a factory of partial updates that send only a new phone"""
+    def make_request():
+        body = {"phone": f"+1555{random.randint(0, 9999999):07d}"}
+        return "PATCH", f"{BASE_URL}/{random.choice(ids)}", None, body
+    return make_request
+
+
+def multi_get(ids):
+    """Returns a factory of multi-gets of a page worth of random ids"""
+    def make_request():
+        return "POST", f"{BASE_URL}/_mget", None, {"ids": random.sample(ids, min(20, len(ids)))}
+    return make_request
+
+
+def scenarios(customers):
+    """Returns the request factory of every scenario, in run order"""
+    ids = [customer["id"] for customer in customers]
+    # Each seeded Customer is deleted at most once, the rest are repeats
+    deletable = ids[:]
+    random.shuffle(deletable)
+
+    def get():
+        return "GET", f"{BASE_URL}/{random.choice(ids)}", None, None
+
+    def list_page():
+        return "GET", BASE_URL, {"limit": 20}, None
+
+    def list_by(field):
+        def make_request():
+            return "GET", BASE_URL, {field: str(random.choice(customers)[field]), "limit": 20}, None
+        return make_request
+
+    def create():
+        body = CustomerFactory(email=f"bench-{uuid.uuid4().hex}@example.com", acc_active=True).serialize()
+        return "POST", BASE_URL, None, body
+
+    def update():
+        body = dict(random.choice(customers), phone=f"+1555{random.randint(0, 9999999):07d}")
+        return "PUT", f"{BASE_URL}/{body['id']}", None, body
+
+    def activate():
+        return random.choice(("PUT", "DELETE")), f"{BASE_URL}/{random.choice(ids)}/active", None, None
+
+    def delete():
+        customer_id = deletable.pop() if deletable else random.choice(ids)
+        return "DELETE", f"{BASE_URL}/{customer_id}", None, None
+
+    result = {"get": get, "mget": multi_get(ids), "list": list_page}
+    for field in Customer.FILTERS:
+        result[f"list_by_{field}"] = list_by(field)
+    result.update(search=search_by_prefix(customers), create=create, update=update, patch=patch_phone(ids),
+                  activate=activate, delete=delete)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the scenarios of a run with a baseline run
+
+    Returns:
+        list: a description of every metric that regressed beyond tolerance
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            before, after = previous[metric], current[metric]
+            if not before:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{name} {metric}: {before} -> {after} ({change:+.0%})")
+    return regressions
+
+
+def run(args):
+    """Seeds the database and runs the selected scenarios against one server"""
+    customers = seed(args.customers)
+    available = scenarios(customers)
+    selected = args.scenarios.split(",") if args.scenarios else list(available)
+    unknown = set(selected) - set(available)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = {
+        "meta": {
+            "server": args.server,
+            "workers": args.workers,
+            "customers": args.customers,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "python": platform.python_version(),
+        },
+        "scenarios": {},
+    }
+    with serve(args.server, args.port, args.workers) as base_url:
+        for name in selected:
+            print(f"Running {name} ...", file=sys.stderr)
+            results["scenarios"][name] = run_scenario(
+                base_url, available[name], args.concurrency, args.duration, args.warmup
+            )
+    return results
+
+
+def main():
+    """Runs the benchmark, prints or saves the results and checks the baseline"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=1000, help="Customers to seed")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to drive each scenario")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds to warm up before each scenario")
+    parser.add_argument("--server", choices=sorted(SERVERS), default="sync", help="Server to benchmark")
+    parser.add_argument("--workers", type=int, default=1, help="Server worker processes")
+    parser.add_argument("--port", type=int, default=8181, help="Port to run the server on")
+    parser.add_argument("--scenarios", help="Comma separated scenarios to run (default: all)")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression of throughput, p95 and p99")
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Serializer micro-benchmark
+
+Compares the per-row cost of the old response path (Customer.serialize()
+followed by flask-restx marshalling and json.dumps) with the compiled
+Customer.to_json serializer, for a single Customer and for a list.
+
+Usage:
+  DATABASE_URI=sqlite:// python -m benchmarks.serializer_bench [--rows 100] [--repeat 2000]
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime
+from flask_restx import marshal
+from service.common.serializer import available_backends, compile_serializer, json_array
+from service.models import Customer
+from service.routes import customer_model
+from tests.factories import CustomerFactory
+
+
+def make_customers(count):
+    """Builds transient Customers with every column filled in"""
+    customers = []
+    for index in range(count):
+        customer = CustomerFactory(id=index + 1, acc_active=True, version=1)
+        customer.created_at = customer.updated_at = datetime(2022, 11, 1, 12, 30)
+        customers.append(customer)
+    return customers
+
+
+def per_row_microseconds(function, rows, repeat):
+    """Returns the best per-row time of a function in microseconds"""
+    best = min(timeit.repeat(function, number=repeat, repeat=5))
+    return best / repeat / rows * 1e6
+
+
+def run(rows, repeat):
+    """Times every serializer for one Customer and for a list of them"""
+    customers = make_customers(rows)
+    single = customers[0]
+    candidates = {
+        "serialize+marshal": (
+            lambda: json.dumps(marshal(single.serialize(), customer_model)),
+            lambda: json.dumps(marshal([customer.serialize() for customer in customers], customer_model)),
+        ),
+    }
+    for backend in available_backends():
+        serialize = compile_serializer(Customer.json_fields(), backend=backend)
+        candidates[f"to_json[{backend}]"] = (
+            lambda serialize=serialize: serialize(single),
+            lambda serialize=serialize: json_array(serialize(customer) for customer in customers),
+        )
+
+    results = {}
+    for name, (one, many) in candidates.items():
+        results[name] = {
+            "single_us": round(per_row_microseconds(one, 1, repeat), 3),
+            "list_us_per_row": round(per_row_microseconds(many, rows, max(repeat // rows, 1)), 3),
+        }
+    return results
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100, help="Customers in the list response")
+    parser.add_argument("--repeat", type=int, default=2000, help="Serializations per timing run")
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Startup benchmark
+
+Measures how fast the service starts and how much memory its workers use:
+
+* import: time to import the service package in a fresh interpreter
+* ready: time from launching gunicorn until /health answers
+* memory: resident (RSS) and proportional (PSS) memory of each worker,
+  where PSS divides pages shared with the master between the processes
+
+gunicorn is started with and without --preload so the two can be
+compared. Memory is read from /proc and so is only reported on Linux.
+
+Usage:
+  DATABASE_URI=sqlite:////tmp/customers_bench.db python -m benchmarks.startup_bench \\
+      [--workers 2] [--repeat 5] [--port 8182]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from benchmarks.harness import wait_until_up
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import service; print(time.perf_counter() - started)"
+
+
+def import_seconds(repeat):
+    """Returns the median time to import the service in a new interpreter"""
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET], check=True, capture_output=True, text=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def memory_kib(pid):
+    """Returns the Rss and Pss of a process in KiB, if /proc has them"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as rollup:
+            for line in rollup:
+                name, _, rest = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    values[name.lower() + "_kib"] = int(rest.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+def children(pid):
+    """Returns the ids of the child processes of a process"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="utf-8") as listing:
+            return [int(child) for child in listing.read().split()]
+    except OSError:
+        return []
+
+
+def gunicorn_startup(workers, preload, port):
+    """Starts gunicorn and returns its time to ready and worker memory"""
+    command = [
+        sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind", f"127.0.0.1:{port}",
+        "--log-level", "warning", "service:app",
+    ]
+    env = dict(os.environ, GUNICORN_PRELOAD="true" if preload else "false")
+    started = time.perf_counter()
+    with subprocess.Popen(command, env=env) as server:
+        try:
+            asyncio.run(wait_until_up(f"http://127.0.0.1:{port}", timeout=60.0))
+            ready = time.perf_counter() - started
+            # Give the remaining workers time to boot before reading memory
+            time.sleep(1.0)
+            worker_memory = [memory_kib(pid) for pid in children(server.pid)]
+        finally:
+            server.terminate()
+            server.wait()
+    result = {"ready_seconds": round(ready, 3), "workers": worker_memory}
+    pss = [memory["pss_kib"] for memory in worker_memory if "pss_kib" in memory]
+    if pss:
+        result["mean_worker_pss_kib"] = round(statistics.mean(pss))
+    return result
+
+
+def run(workers, repeat, port):
+    """Measures the import time and gunicorn startup with and without preload"""
+    return {
+        "import_seconds": round(import_seconds(repeat), 3),
+        "gunicorn": {
+            "preload": gunicorn_startup(workers, True, port),
+            "no_preload": gunicorn_startup(workers, False, port),
+        },
+    }
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers to start")
+    parser.add_argument("--repeat", type=int, default=5, help="Imports to time")
+    parser.add_argument("--port", type=int, default=8182, help="Port to run gunicorn on")
+    args = parser.parse_args()
+    print(json.dumps(run(args.workers, args.repeat, args.port), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Gunicorn configuration
+
+gunicorn reads this file from the working directory. Settings can still be
+overridden on the command line, with GUNICORN_CMD_ARGS or with the
+GUNICORN_* variables below.
+
+Workers and threads are sized to the container's cgroup limits rather than
+to the host's cores: a pod limited to 0.2 CPU gets one worker even on a
+large node. Requests mostly wait on the database, so a fractional CPU is
+better used by one gthread worker with a few threads than by more sync
+workers, each costing a full copy of the app's memory. Keep the threads of
+a worker at or below DB_POOL_SIZE + DB_MAX_OVERFLOW.
+
+With preload the app is imported once in the master and forked into the
+workers so they share its memory pages copy-on-write and start without
+importing anything. Importing the service does not open database
+connections. The master creates the schema in on_starting and drops its
+connections afterwards, and every worker drops any connection it inherited
+before serving. Without preload the master runs `flask db-init` in a child
+process instead, so it never imports the app and each worker loads its own.
+
+Workers are restarted after max_requests (plus a random jitter so they do
+not all restart at once) to bound slow memory growth, and log their memory
+use when they exit.
+"""
+import math
+import os
+import subprocess
+import sys
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# Memory of one worker (PSS, with preload) used to fit workers in the limit
+WORKER_MEMORY_MB = int(os.getenv("GUNICORN_WORKER_MEMORY_MB", "24"))
+
+
+def read_first(*paths):
+    """Returns the stripped contents of the first readable file, or None"""
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as file:
+                return file.read().strip()
+        except OSError:
+            continue
+    return None
+
+
+def cpu_limit(root=CGROUP_ROOT):
+    """Returns the CPU quota of the cgroup in cores, or None when unlimited"""
+    cpu_max = read_first(os.path.join(root, "cpu.max"))
+    if cpu_max:  # cgroup v2: "<quota> <period>" or "max <period>"
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max":
+            return int(quota) / int(period or 100000)
+        return None
+    quota = read_first(os.path.join(root, "cpu", "cpu.cfs_quota_us"), os.path.join(root, "cpu.cfs_quota_us"))
+    period = read_first(os.path.join(root, "cpu", "cpu.cfs_period_us"), os.path.join(root, "cpu.cfs_period_us"))
+    if quota and period and int(quota) > 0:  # cgroup v1: -1 means unlimited
+        return int(quota) / int(period)
+    return None
+
+
+def memory_limit(root=CGROUP_ROOT):
+    """Returns the memory limit of the cgroup in bytes, or None when unlimited"""
+    limit = read_first(
+        os.path.join(root, "memory.max"),
+        os.path.join(root, "memory", "memory.limit_in_bytes"),
+        os.path.join(root, "memory.limit_in_bytes"),
+    )
+    # cgroup v1 reports "unlimited" as a huge page-aligned number
+    if not limit or limit == "max" or int(limit) >= 2 ** 60:
+        return None
+    return int(limit)
+
+
+def worker_count(cpus, memory, worker_memory_mb=WORKER_MEMORY_MB):
+    """
+    Returns the number of workers for a CPU and memory limit
+
+    The usual 2 * cores + 1 is capped by how many workers fit in the memory
+    limit next to the master, and is never below one.
+    """
+    workers = 2 * math.floor(cpus) + 1
+    if memory is not None:
+        workers = min(workers, memory // (worker_memory_mb * 1024 * 1024) - 1)
+    return max(1, workers)
+
+
+cpu_cores = cpu_limit() or os.cpu_count() or 1
+memory_bytes = memory_limit()
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("true", "yes", "1")
+workers = int(os.getenv("GUNICORN_WORKERS", "0")) or worker_count(cpu_cores, memory_bytes)
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread" if threads > 1 else "sync")
+
+# Keep idle connections from the ingress open a little longer than its own
+# keep-alive would poll, and fail requests before the readiness probe does
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "20"))
+
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+
+# Worker heartbeats go to memory instead of the container's overlay disk
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def process_memory_kib():
+    """Returns the current and peak resident memory of this process in KiB"""
+    values = {}
+    status = read_first("/proc/self/status") or ""
+    for line in status.splitlines():
+        name, _, rest = line.partition(":")
+        if name in ("VmRSS", "VmHWM"):
+            values[name] = int(rest.split()[0])
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+def when_ready(server):
+    """Logs how the workers were sized"""
+    server.log.info(
+        "Sized for %.2f CPUs and %s memory: %d %s workers x %d threads, max_requests=%d+%d",
+        cpu_cores, f"{memory_bytes // (1024 * 1024)}MiB" if memory_bytes else "unlimited",
+        server.cfg.workers, server.cfg.worker_class_str, server.cfg.threads,
+        server.cfg.max_requests, server.cfg.max_requests_jitter,
+    )
+
+
+def on_starting(server):
+    """Creates the database schema once, before any worker is started"""
+    if not server.cfg.preload_app:
+        # Without preload the master never imports the app: a child process
+        # creates the schema, so its modules and connections die with it
+        env = dict(os.environ, FLASK_APP=os.getenv("FLASK_APP", "service"))
+        if subprocess.run([sys.executable, "-m", "flask", "db-init"], env=env, check=False).returncode:
+            server.log.critical("flask db-init failed: Cannot continue")
+            sys.exit(4)
+        return
+    # pylint: disable=import-outside-toplevel
+    from service import create_app
+    from service.models import Customer
+
+    app = create_app()
+    try:
+        Customer.create_schema(app)
+    except Exception as error:  # pylint: disable=broad-except
+        server.log.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
+    # Workers must not share the master's sockets
+    Customer.dispose_engine(app)
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Forgets the connections a preloaded worker inherited from the master"""
+    if "service" not in sys.modules:
+        return
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.models import Customer
+
+    Customer.dispose_engine(app, close=False)
+
+
+def worker_exit(server, worker):
+    """Logs the memory of a worker as it exits, e.g. when it is recycled"""
+    rss, peak = process_memory_kib()
+    server.log.info(
+        "Worker %s exiting after %d requests: rss=%sKiB peak=%sKiB",
+        worker.pid, worker.nr, rss, peak,
+    )
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the live metrics of a dead worker from the multiprocess directory"""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
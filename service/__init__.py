@@ -3,8 +3,12 @@ Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
+
+Importing the package does not touch the database: the schema is created
+by `flask db-init` or by the gunicorn on_starting hook in gunicorn.conf.py
+and connections are opened on first use. That keeps imports fast and makes
+the app safe to load once in the gunicorn master with --preload.
 """
-import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
@@ -31,20 +35,35 @@ api = Api(app,
 # pylint: disable=wrong-import-position, wrong-import-order
 from service import routes         # noqa: E402, E261
 # pylint: disable=wrong-import-position
-from .common import error_handlers, cli_commands  # noqa: F401 E402
+from .common import error_handlers, cli_commands, compression, metrics  # noqa: F401 E402
+
+
+def create_app():
+    """
+    Finishes setting up the app: logging, metrics, compression and the
+    database session
+
+    The routes are registered on the module level app when the package is
+    imported, so this configures and returns that app. Calling it again
+    returns the same app without repeating the setup.
+    """
+    if app.extensions.get("sqlalchemy") is not None:
+        return app
+
+    # Set up logging for production
+    log_handlers.init_logging(app, "gunicorn.error")
+    metrics.init_metrics(app)
+    # Registered after metrics so it runs first and metrics see the bytes sent
+    compression.init_compression(app)
+
+    app.logger.info(70 * "*")
+    app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
+    routes.init_db()  # configures SQLAlchemy without connecting
 
-app.logger.info(70 * "*")
-app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+    app.logger.info("Service initialized!")
+    return app
 
-try:
-    routes.init_db()  # make our SQLAlchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
 
-app.logger.info("Service initialized!")
+create_app()
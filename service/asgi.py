@@ -0,0 +1,368 @@
+"""
+ASGI Entry Point
+
+Serves the Customer API on an asyncio event loop so that one worker can
+keep many requests waiting on the database at the same time:
+
+    flask db-init
+    uvicorn service.asgi:app --host 0.0.0.0 --port 8080
+
+The /api/customers and /api/customers/<id> routes run natively on the
+SQLAlchemy asyncio engine (asyncpg for PostgreSQL, aiosqlite for SQLite).
+They use the statements, normalization, cache and serializer of
+service.models, so the JSON contract matches the Flask app. Every other
+route is handed to the Flask app on a thread pool. Large responses of the
+native routes are gzip compressed with the Flask app's size threshold.
+"""
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from service import app as flask_app
+from service.models import (
+    Customer, DataConflictError, DataValidationError, is_unique_violation, make_etag, to_bool
+)
+from service.routes import (
+    COUNT_MODES, NDJSON_MIMETYPE, abort, decode_cursor, encode_cursor, if_match_versions, is_digits,
+    parse_filters, total_count_headers,
+)
+from service.common import status
+from service.common.serializer import json_array
+
+# Async driver used for each database backend
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+engine = None  # pylint: disable=invalid-name
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def async_database_uri(config):
+    """Returns the async driver URI for the configured database"""
+    if config["ASYNC_DATABASE_URI"]:
+        return config["ASYNC_DATABASE_URI"]
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for '{backend}', set ASYNC_DATABASE_URI")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def create_engine(config):
+    """Creates the async engine, sized like the Flask app's pool"""
+    url = make_url(async_database_uri(config))
+    options = {"pool_pre_ping": config["DB_POOL_PRE_PING"]}
+    if url.get_backend_name() == "postgresql" or url.database not in (None, "", ":memory:"):
+        # SQLite files would otherwise open a connection and thread per request
+        options.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=config["DB_POOL_SIZE"],
+            max_overflow=config["DB_MAX_OVERFLOW"],
+            pool_timeout=config["DB_POOL_TIMEOUT"],
+            pool_recycle=config["DB_POOL_RECYCLE"],
+        )
+    if url.get_backend_name() == "postgresql":
+        options.update(
+            connect_args={
+                "timeout": config["DB_CONNECT_TIMEOUT"],
+                "server_settings": {
+                    "application_name": config["DB_APPLICATION_NAME"],
+                    "statement_timeout": str(config["DB_STATEMENT_TIMEOUT_MS"]),
+                },
+            },
+        )
+    return create_async_engine(url, **options)
+
+
+def json_response(body, code=status.HTTP_200_OK, headers=None):
+    """Wraps JSON text that is already serialized in a response"""
+    return Response(body, status_code=code, headers=headers, media_type="application/json")
+
+
+def not_found(customer_id):
+    """Aborts with 404 for a missing Customer"""
+    abort(status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found.")
+
+
+def precondition_failed():
+    """Aborts with 412 for an If-Match header that does not match"""
+    abort(status.HTTP_412_PRECONDITION_FAILED, "The Customer does not match the If-Match header.")
+
+
+async def read_customer(request):
+    """Deserializes and normalizes the Customer in a JSON request body"""
+    if request.headers.get("content-type", "").split(";")[0].strip() != "application/json":
+        raise DataValidationError("Content-Type must be application/json")
+    try:
+        data = await request.json()
+    except ValueError as error:
+        raise DataValidationError(f"Invalid JSON: {error}") from error
+    return Customer().deserialize(data).normalize()
+
+
+async def returning_row(conn, statement, customer_id=None):
+    """Executes an INSERT or UPDATE and returns the Customer row it wrote
+
+    RETURNING is used where the dialect supports it, otherwise the row is
+    read back on the same connection.
+    """
+    table = Customer.__table__
+    if conn.dialect.full_returning:
+        return (await conn.execute(statement.returning(*table.c))).first()
+    result = await conn.execute(statement)
+    if customer_id is None:
+        customer_id = result.inserted_primary_key[0]
+    elif not result.rowcount:
+        return None
+    return (await conn.execute(table.select().where(table.c.id == customer_id))).first()
+
+
+def write_error(error, email):
+    """Turns an IntegrityError from a write into the matching model error"""
+    if is_unique_violation(error):
+        return DataConflictError(f"Another Customer with email '{email}' found.")
+    return DataValidationError(f"Invalid Customer: {error.orig}")
+
+
+def wants_ndjson(request):
+    """Checks if the client asked for a streamed NDJSON response"""
+    if "stream" in request.query_params and to_bool(request.query_params["stream"]):
+        return True
+    accept = parse_accept_header(request.headers.get("accept"), MIMEAccept)
+    return accept.best_match(["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+######################################################################
+#  PATH: /api/customers/{id}
+######################################################################
+async def get_customer(request):
+    """Returns a Customer by id, reading through the shared Customer cache
+
+    Sparse fieldsets select only their columns and skip the cache.
+    """
+    customer_id = request.path_params["customer_id"]
+    fields = Customer.parse_fields(request.query_params.get("fields"))
+    key = str(customer_id)
+    entry = Customer.cache.get(key) if fields is None else None
+    if entry is None:
+        async with engine.connect() as conn:
+            row = (await conn.execute(Customer.get_statement(customer_id, fields))).first()
+        if row is None:
+            not_found(customer_id)
+        entry = (make_etag(row.id, row.version), Customer.serializer(fields)(row))
+        if fields is None:
+            Customer.cache.set(key, entry)
+
+    etag, body = entry
+    headers = {"ETag": quote_etag(etag, weak=fields is not None)}
+    if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return json_response(body, status.HTTP_200_OK, headers)
+
+
+async def update_customer(request):
+    """Replaces a Customer, honouring If-Match in the UPDATE statement"""
+    customer_id = request.path_params["customer_id"]
+    customer = await read_customer(request)
+    versions = if_match_versions(parse_etags(request.headers.get("if-match")), customer_id)
+    statement = Customer.update_statement(customer_id, customer.column_values(), versions)
+    table = Customer.__table__
+    found = None
+    try:
+        async with engine.begin() as conn:
+            row = await returning_row(conn, statement, customer_id)
+            if row is None:
+                found = await conn.scalar(select(table.c.id).where(table.c.id == customer_id))
+    except IntegrityError as error:
+        raise write_error(error, customer.email) from error
+    finally:
+        Customer.cache.delete(str(customer_id))
+    if row is None and found is None:
+        not_found(customer_id)
+    if row is None:
+        precondition_failed()
+    return json_response(
+        Customer.row_to_json(row), status.HTTP_200_OK, {"ETag": quote_etag(make_etag(row.id, row.version))}
+    )
+
+
+async def delete_customer(request):
+    """Deletes a Customer with one statement; missing Customers still get 204"""
+    customer_id = request.path_params["customer_id"]
+    if_match = parse_etags(request.headers.get("if-match"))
+    statement = Customer.delete_statement(customer_id, if_match_versions(if_match, customer_id))
+    async with engine.begin() as conn:
+        deleted = (await conn.execute(statement)).rowcount
+    Customer.cache.delete(str(customer_id))
+    if if_match and not deleted:
+        precondition_failed()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+async def count_headers(criteria, mode):
+    """Counts the Customers matching the criteria like routes.count_headers"""
+    if mode == "none":
+        return {}
+    threshold = flask_app.config["COUNT_EXACT_THRESHOLD"]
+    async with engine.connect() as conn:
+        if mode == "estimated":
+            statement = Customer.estimate_statement(criteria, engine.dialect)
+            if statement is not None:
+                estimated = Customer.read_estimate((await conn.execute(statement)).scalar())
+                if estimated >= threshold:
+                    return total_count_headers(estimated, False)
+        total = (await conn.execute(Customer.count_statement(criteria))).scalar()
+    return total_count_headers(total, True)
+
+
+######################################################################
+#  PATH: /api/customers
+######################################################################
+async def list_customers(request):
+    """Returns a page of Customers, or streams all of them as NDJSON
+
+    HEAD requests only count the Customers, see count_headers
+    """
+    args = request.query_params
+    head = request.method == "HEAD"
+    mode = args.get("count", "estimated" if head else "none")
+    if mode not in COUNT_MODES:
+        abort(status.HTTP_400_BAD_REQUEST, f"count must be one of {', '.join(COUNT_MODES)}.")
+    limit = args.get("limit")
+    if limit is not None:
+        if not is_digits(limit):
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid limit '{limit}'.")
+        limit = int(limit)
+    page_size = limit if limit is not None else flask_app.config["PAGE_SIZE_DEFAULT"]
+    if not 1 <= page_size <= flask_app.config["PAGE_SIZE_MAX"]:
+        abort(status.HTTP_400_BAD_REQUEST, f"limit must be between 1 and {flask_app.config['PAGE_SIZE_MAX']}.")
+    after_id = decode_cursor(args["cursor"]) if "cursor" in args else None
+    criteria = parse_filters(args)
+    fields = Customer.parse_fields(args.get("fields"))
+    headers = await count_headers(criteria, mode)
+    if head:
+        return Response(status_code=status.HTTP_200_OK, headers=headers)
+
+    if wants_ndjson(request):
+        # Streams are not paged unless the client asks for a limit
+        statement = Customer.select_statement(criteria, limit, after_id, fields)
+        return StreamingResponse(stream_ndjson(statement, fields), headers=headers, media_type=NDJSON_MIMETYPE)
+
+    # Fetch one extra row to find out if there is a next page
+    statement = Customer.select_statement(criteria, page_size + 1, after_id, fields)
+    async with engine.connect() as conn:
+        rows = (await conn.execute(statement)).all()
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        url = request.url.include_query_params(limit=page_size, cursor=encode_cursor(rows[-1].id))
+        headers["Link"] = f'<{url}>; rel="next"'
+    serialize = Customer.serializer(fields)
+    return json_response(json_array(serialize(row) for row in rows), status.HTTP_200_OK, headers)
+
+
+async def stream_ndjson(statement, fields=None):
+    """Yields the Customers of a statement one JSON document per line"""
+    batch_size = flask_app.config["STREAM_BATCH_SIZE"]
+    serialize = Customer.serializer(fields)
+    async with engine.connect() as conn:
+        result = await conn.stream(statement.execution_options(yield_per=batch_size))
+        async for row in result:
+            yield serialize(row) + "\n"
+
+
+async def create_customer(request):
+    """Creates a Customer from the JSON body"""
+    customer = await read_customer(request)
+    # Leave unset columns like acc_active to their server defaults as the ORM does
+    values = {column: value for column, value in customer.column_values().items() if value is not None}
+    try:
+        async with engine.begin() as conn:
+            row = await returning_row(conn, Customer.__table__.insert().values(**values))
+    except IntegrityError as error:
+        raise write_error(error, customer.email) from error
+    Customer.cache.delete(str(row.id))
+    location = str(request.url_for("customer", customer_id=row.id))
+    return json_response(Customer.row_to_json(row), status.HTTP_201_CREATED, {"Location": location})
+
+
+######################################################################
+#  E R R O R   H A N D L E R S
+######################################################################
+async def data_validation_error(request, error):  # pylint: disable=unused-argument
+    """Handles bad data like the API's 400_BAD_REQUEST handler"""
+    flask_app.logger.warning(str(error))
+    return JSONResponse(
+        {"status_code": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": str(error)},
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+async def data_conflict_error(request, error):  # pylint: disable=unused-argument
+    """Handles unique constraint violations with 409_CONFLICT"""
+    flask_app.logger.warning(str(error))
+    return JSONResponse(
+        {"status_code": status.HTTP_409_CONFLICT, "error": "Conflict", "message": str(error)},
+        status.HTTP_409_CONFLICT,
+    )
+
+
+async def http_error(request, error):  # pylint: disable=unused-argument
+    """Handles the aborts raised by helpers shared with service.routes"""
+    return JSONResponse(getattr(error, "data", None) or {"message": error.description}, error.code)
+
+
+######################################################################
+#  A P P L I C A T I O N
+######################################################################
+@asynccontextmanager
+async def lifespan(_app):
+    """Creates the async engine at startup and disposes it at exit
+
+    The schema is not created here: every uvicorn worker runs the lifespan,
+    and concurrent workers would race on CREATE EXTENSION and CREATE TABLE.
+    Run `flask db-init` once before starting the workers.
+    """
+    global engine  # pylint: disable=global-statement, invalid-name
+    engine = create_engine(flask_app.config)
+    flask_app.logger.info("Async database engine established")
+    yield
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/customers/{customer_id:int}", get_customer, methods=["GET"], name="customer"),
+        Route("/api/customers/{customer_id:int}", update_customer, methods=["PUT"]),
+        Route("/api/customers/{customer_id:int}", delete_customer, methods=["DELETE"]),
+        Route("/api/customers", list_customers, methods=["GET"]),
+        Route("/api/customers", create_customer, methods=["POST"]),
+        # Everything else, including other methods on the paths above
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    # The Flask app compresses its own responses, which this then leaves alone
+    middleware=[
+        Middleware(
+            GZipMiddleware,
+            minimum_size=flask_app.config["COMPRESS_MIN_SIZE"],
+            compresslevel=flask_app.config["COMPRESS_LEVEL"],
+        ),
+    ] if "gzip" in flask_app.extensions["compression"] else [],
+    exception_handlers={
+        DataValidationError: data_validation_error,
+        DataConflictError: data_conflict_error,
+        HTTPException: http_error,
+    },
+    lifespan=lifespan,
+)
@@ -1,8 +1,22 @@
 """
 Flask CLI Command Extensions
 """
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+import click
 from service import app
-from service.models import db
+from service.models import Customer, db
+
+# Columns a Customer import or export file carries, in file order
+IMPORT_COLUMNS = (
+    "firstname", "lastname", "email", "phone", "street_line1", "street_line2",
+    "city", "state", "country", "zipcode", "acc_active",
+)
+REQUIRED_COLUMNS = tuple(column for column in IMPORT_COLUMNS if column not in ("street_line2", "acc_active"))
 
 
 ######################################################################
@@ -19,3 +33,321 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to create the tables and indexes that do not exist yet
+# Usage:
+#   flask db-init
+######################################################################
+@app.cli.command("db-init")
+def db_init():
+    """
+    Creates any missing tables and indexes without touching existing data
+    """
+    Customer.create_schema(app)
+
+
+######################################################################
+# Command to bulk load Customers with PostgreSQL COPY
+# Usage:
+#   flask customers-import customers.csv
+#   flask customers-import --format ndjson --on-duplicate update - < customers.ndjson
+######################################################################
+@app.cli.command("customers-import")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]),
+              help="Input format (defaults to the file extension, then csv)")
+@click.option("--on-duplicate", type=click.Choice(["skip", "update"]), default="skip",
+              show_default=True, help="What to do with rows whose email already exists")
+@click.option("--progress-every", type=int, default=10000, show_default=True,
+              help="Report progress after this many rows")
+def customers_import(source, file_format, on_duplicate, progress_every):
+    """
+    Streams Customers from a CSV or NDJSON file into the database using
+    COPY into a staging table followed by a single merge statement
+    """
+    if db.engine.dialect.name != "postgresql":
+        raise click.ClickException("customers-import requires PostgreSQL COPY")
+    file_format = file_format or guess_format(source.name)
+    progress = Progress("read", progress_every)
+    rows = (progress.tick(record_to_row(record)) for record in read_records(source, file_format))
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(create_staging_sql())
+        cursor.copy_expert(
+            f"COPY customer_import ({', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            IterReader(csv_chunks(rows)),
+        )
+        cursor.execute(merge_sql(on_duplicate))
+        merged = cursor.rowcount
+        connection.commit()
+    finally:
+        connection.close()
+
+    progress.done()
+    click.echo(f"Merged {merged} of {progress.count} rows ({progress.count - merged} skipped)")
+
+
+######################################################################
+# Command to dump Customers without loading the table into memory
+# Usage:
+#   flask customers-export customers.csv
+#   flask customers-export --format ndjson --active-only --updated-since 2022-11-01 -
+######################################################################
+@app.cli.command("customers-export")
+@click.argument("target", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]),
+              help="Output format (defaults to the file extension, then csv)")
+@click.option("--active-only", is_flag=True, help="Only export active Customers")
+@click.option("--updated-since", type=click.DateTime(),
+              help="Only export Customers updated at or after this time")
+@click.option("--batch-size", type=int, default=1000, show_default=True,
+              help="Rows fetched per round-trip by the server-side cursor")
+@click.option("--progress-every", type=int, default=10000, show_default=True,
+              help="Report progress after this many rows")
+def customers_export(target, file_format, active_only, updated_since, batch_size, progress_every):
+    """
+    Writes Customers to a file or stdout as CSV (using COPY ... TO STDOUT)
+    or NDJSON (using a named server-side cursor)
+    """
+    if db.engine.dialect.name != "postgresql":
+        raise click.ClickException("customers-export requires PostgreSQL")
+    file_format = file_format or guess_format(target.name)
+    progress = Progress("written", progress_every)
+    where, params = export_filters(active_only, updated_since)
+    columns = ("id",) + IMPORT_COLUMNS + ("created_at", "updated_at")
+    query = f"SELECT {', '.join(columns)} FROM {Customer.__table__.name}{where} ORDER BY id"
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if file_format == "csv":
+            # COPY cannot take bind parameters so let the driver inline them
+            copy = f"COPY ({cursor.mogrify(query, params).decode()}) TO STDOUT WITH (FORMAT csv)"
+            target.write(",".join(columns) + "\n")
+            cursor.copy_expert(copy, CountingWriter(target, progress))
+        else:
+            cursor.close()
+            # A named cursor keeps the result set on the server
+            cursor = connection.cursor(name="customers_export")
+            cursor.itersize = batch_size
+            cursor.execute(query, params)
+            for row in cursor:
+                target.write(json.dumps(dict(zip(columns, row)), default=json_default) + "\n")
+                progress.tick(row)
+        cursor.close()
+        connection.commit()
+    finally:
+        connection.close()
+
+    progress.done()
+
+
+######################################################################
+# Command to purge Customers by id in bounded batches
+# Usage:
+#   flask customers-delete ids.txt
+#   flask customers-delete --batch-size 200 - < ids.txt
+######################################################################
+@app.cli.command("customers-delete")
+@click.argument("source", type=click.File("r", encoding="utf-8"), default="-")
+@click.option("--batch-size", type=click.IntRange(min=1), default=500, show_default=True,
+              help="Ids removed by each DELETE statement and commit")
+@click.option("--progress-every", type=int, default=10000, show_default=True,
+              help="Report progress after this many ids")
+def customers_delete(source, batch_size, progress_every):
+    """
+    Deletes the Customers whose ids are listed one per line in a file or
+    stdin. Ids that do not exist are skipped.
+    """
+    progress = Progress("processed", progress_every)
+    deleted = 0
+    for count, batch_deleted in Customer.delete_many(read_ids(source), batch_size):
+        progress.advance(count)
+        deleted += batch_deleted
+
+    progress.done()
+    click.echo(f"Deleted {deleted} of {progress.count} ids ({progress.count - deleted} not found)")
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+class Progress:
+    """Counts rows as they stream by and reports the rate"""
+
+    def __init__(self, verb, every):
+        self.verb = verb
+        self.every = every
+        self.count = 0
+        self.started = time.monotonic()
+
+    def tick(self, item):
+        """Counts one row, reporting every so often, and passes it through"""
+        self.count += 1
+        if self.every and self.count % self.every == 0:
+            self.report()
+        return item
+
+    def advance(self, count):
+        """Counts a batch of rows, reporting when it crosses a reporting point"""
+        before = self.count
+        self.count += count
+        if self.every and before // self.every != self.count // self.every:
+            self.report()
+
+    def report(self):
+        """Reports the rows seen so far and the rows per second"""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        click.echo(f"{self.count} rows {self.verb} ({self.count / elapsed:.0f} rows/sec)", err=True)
+
+    def done(self):
+        """Reports the final count"""
+        self.report()
+
+
+class IterReader:
+    """A minimal file-like object that lets COPY pull text from a generator"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = ""
+
+    def read(self, size=-1):
+        """Returns up to size characters, or everything that is left"""
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class CountingWriter:
+    """Wraps a file so the rows COPY writes to it are counted"""
+
+    def __init__(self, target, progress):
+        self._target = target
+        self._progress = progress
+
+    def write(self, data):
+        """Writes a chunk of COPY output, counting the lines in it"""
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        for _ in range(data.count("\n")):
+            self._progress.tick(None)
+        return self._target.write(data)
+
+
+def export_filters(active_only, updated_since):
+    """Returns the WHERE clause and parameters for an export"""
+    conditions = []
+    params = {}
+    if active_only:
+        conditions.append("acc_active")
+    if updated_since:
+        conditions.append("updated_at >= %(updated_since)s")
+        params["updated_since"] = updated_since
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+
+def json_default(value):
+    """Encodes the values json does not know about, like timestamps"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def guess_format(filename):
+    """Guesses the file format from its extension"""
+    _, extension = os.path.splitext(filename or "")
+    return "ndjson" if extension.lower() in (".ndjson", ".jsonl") else "csv"
+
+
+def read_records(source, file_format):
+    """Yields one dictionary per Customer in a CSV or NDJSON file"""
+    if file_format == "ndjson":
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(source)
+
+
+def read_ids(source):
+    """Yields the Customer ids listed one per line, skipping blank lines"""
+    for number, line in enumerate(source, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if not (line.isascii() and line.isdecimal()):
+            raise click.ClickException(f"Line {number} is not a Customer id: {line!r}")
+        yield int(line)
+
+
+def record_to_row(record):
+    """Orders the values of a Customer record as IMPORT_COLUMNS"""
+    return [record.get(column) for column in IMPORT_COLUMNS]
+
+
+def csv_chunks(rows):
+    """Yields each row as a line of CSV, reusing a single buffer"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+
+def create_staging_sql():
+    """Returns the DDL for the temporary table that COPY loads into
+
+    COPY names the other columns, so ordinal numbers the rows in file order.
+    """
+    columns = ", ".join(f"{column} text" for column in IMPORT_COLUMNS[:-1])
+    return (
+        f"CREATE TEMP TABLE customer_import (ordinal bigserial, {columns}, acc_active boolean) "
+        "ON COMMIT DROP"
+    )
+
+
+def merge_sql(on_duplicate):
+    """
+    Returns the statement that moves staged rows into the customer table
+
+    Rows get the same normalization as the REST API (initcap is the SQL
+    counterpart of str.title), rows missing a required column are skipped
+    and only the first row for each email is kept.
+    """
+    table = Customer.__table__.name
+    select = {column: column for column in IMPORT_COLUMNS}
+    select.update(
+        firstname="initcap(firstname)",
+        lastname="initcap(lastname)",
+        city="initcap(city)",
+        email="lower(email)",
+        street_line2="coalesce(street_line2, '')",
+        acc_active="coalesce(acc_active, true)",
+    )
+    not_null = " AND ".join(f"{column} IS NOT NULL" for column in REQUIRED_COLUMNS)
+    if on_duplicate == "update":
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in IMPORT_COLUMNS if column != "email")
+        conflict = f"DO UPDATE SET {updates}, updated_at = now(), version = {table}.version + 1"
+    else:
+        conflict = "DO NOTHING"
+    return (
+        f"INSERT INTO {table} ({', '.join(IMPORT_COLUMNS)}) "
+        f"SELECT DISTINCT ON (lower(email)) {', '.join(select.values())} "
+        f"FROM customer_import WHERE {not_null} "
+        f"ORDER BY lower(email), ordinal "
+        f"ON CONFLICT (email) {conflict}"
+    )
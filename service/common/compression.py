@@ -0,0 +1,127 @@
+"""
+Compression
+
+This module compresses responses with the best encoding the client accepts
+in Accept-Encoding: zstd (when the optional zstandard package is
+installed), gzip or deflate.
+
+Responses smaller than COMPRESS_MIN_SIZE are sent as they are, since the
+framing costs more than it saves. Streamed responses, like NDJSON lists,
+have no size up front and are always compressed, chunk by chunk as they
+are generated, so they are never buffered in memory.
+"""
+import zlib
+from flask import current_app, request
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional
+    zstandard = None
+
+# zlib window bits of the HTTP encodings: gzip framing and zlib framing
+WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+# Response types worth compressing
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/css",
+    "text/html",
+    "text/plain",
+}
+
+
+def available_encodings():
+    """Returns the encodings that can be used here, most preferred first"""
+    return ("zstd", "gzip", "deflate") if zstandard is not None else ("gzip", "deflate")
+
+
+def choose_encoding(accept_encodings, encodings):
+    """
+    Returns the encoding the client prefers, or None for no compression
+
+    Args:
+        accept_encodings (Accept): the parsed Accept-Encoding header
+        encodings (list): the encodings the server offers, most preferred first
+    """
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressor(encoding, level):
+    """Returns an object with compress() and flush() for an encoding"""
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+
+
+def compress_chunks(chunks, encoding, level):
+    """Compresses an iterable of byte strings as it is consumed"""
+    stream = compressor(encoding, level)
+    for chunk in chunks:
+        data = stream.compress(chunk)
+        if data:
+            yield data
+    yield stream.flush()
+
+
+def should_compress(response):
+    """Checks if a response may be compressed at all"""
+    return (
+        response.status_code >= 200
+        and response.status_code not in (204, 304)
+        and response.mimetype in COMPRESSIBLE_MIMETYPES
+        and "Content-Encoding" not in response.headers
+        and "no-transform" not in response.cache_control
+        and not response.direct_passthrough
+    )
+
+
+######################################################################
+# Request hook and setup
+######################################################################
+def after_request(response):
+    """Compresses the response if the client accepts it and it is large enough"""
+    config = current_app.config
+    encodings = current_app.extensions.get("compression")
+    if not encodings or not should_compress(response):
+        return response
+    # Caches must keep the compressed and plain variants apart
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.accept_encodings, encodings)
+    if encoding is None or request.method == "HEAD":
+        return response
+
+    level = config["COMPRESS_ZSTD_LEVEL" if encoding == "zstd" else "COMPRESS_LEVEL"]
+    if response.is_streamed:
+        response.response = compress_chunks(response.iter_encoded(), encoding, level)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < config["COMPRESS_MIN_SIZE"]:
+            return response
+        stream = compressor(encoding, level)
+        response.set_data(stream.compress(data) + stream.flush())
+    response.headers["Content-Encoding"] = encoding
+    # A strong ETag names the exact bytes, which compression changed
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """Registers response compression with the encodings named in COMPRESS_ENCODINGS"""
+    offered = [encoding.strip() for encoding in app.config["COMPRESS_ENCODINGS"].split(",") if encoding.strip()]
+    unavailable = sorted(set(offered) - set(available_encodings()))
+    if unavailable:
+        app.logger.warning("Compression encodings not available: %s", ", ".join(unavailable))
+    encodings = tuple(encoding for encoding in offered if encoding in available_encodings())
+    app.extensions["compression"] = encodings
+    app.after_request(after_request)
+    app.logger.info("Response compression established: %s", ", ".join(encodings) or "none")
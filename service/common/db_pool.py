@@ -0,0 +1,92 @@
+"""
+Database Connection Pool
+
+This module contains a QueuePool that keeps checkout wait-time and
+saturation counters so the number of gunicorn workers can be sized
+against the database's max_connections
+"""
+import threading
+import time
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    """Thread-safe counters for connection pool checkouts"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pools = []
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def observe(self, wait_seconds, waited, timed_out=False):
+        """Records one checkout attempt and how long it waited"""
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            if waited:
+                self.waits += 1
+            self.wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def reset(self):
+        """Forgets the counters and pools, e.g. those inherited across a fork"""
+        with self._lock:
+            self.pools = []
+            self.checkouts = 0
+            self.waits = 0
+            self.timeouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+
+    def snapshot(self):
+        """Returns the counters and the current saturation of every pool"""
+        with self._lock:
+            stats = {
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+            pools = list(self.pools)
+        stats["size"] = sum(pool.size() for pool in pools)
+        stats["checked_out"] = sum(pool.checkedout() for pool in pools)
+        stats["overflow"] = sum(max(pool.overflow(), 0) for pool in pools)
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that reports checkout wait times to pool_stats"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with pool_stats._lock:  # pylint: disable=protected-access
+            pool_stats.pools.append(self)
+
+    def _do_get(self):
+        # A checkout waits when every pooled and overflow connection is in use
+        waited = self.checkedout() >= self.size() + max(self._max_overflow, 0)
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.observe(time.perf_counter() - start, waited, timed_out=True)
+            raise
+        pool_stats.observe(time.perf_counter() - start, waited)
+        return connection
+
+    def dispose(self):
+        with pool_stats._lock:  # pylint: disable=protected-access
+            if self in pool_stats.pools:
+                pool_stats.pools.remove(self)
+        super().dispose()
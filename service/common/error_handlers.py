@@ -20,7 +20,7 @@ Handles all of the HTTP Error Codes returning JSON messages
 """
 
 from flask import jsonify
-from service.models import DataValidationError, DatabaseConnectionError
+from service.models import DataConflictError, DataValidationError, DatabaseConnectionError
 from service import app, api
 from . import status
 
@@ -47,6 +47,30 @@ def bad_request(error):
     )
 
 
+@api.errorhandler(DataValidationError)
+def api_validation_error(error):
+    """ Handles Value Errors raised in API resources with 400_BAD_REQUEST """
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        'status_code': status.HTTP_400_BAD_REQUEST,
+        'error': 'Bad Request',
+        'message': message
+    }, status.HTTP_400_BAD_REQUEST
+
+
+@api.errorhandler(DataConflictError)
+def data_conflict_error(error):
+    """ Handles unique constraint violations with 409_CONFLICT """
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        'status_code': status.HTTP_409_CONFLICT,
+        'error': 'Conflict',
+        'message': message
+    }, status.HTTP_409_CONFLICT
+
+
 @api.errorhandler(DatabaseConnectionError)
 def database_connection_error(error):
     """ Handles Database Errors from connection attempts """
@@ -0,0 +1,241 @@
+"""
+Metrics
+
+This module collects Prometheus metrics for every request: a count and a
+latency histogram per flask-restx resource and method, the response size
+and the number and duration of the SQL queries each request ran.
+
+Every request is also logged at DEBUG level with its query count,
+optionally sent back in an X-Query-Count header, and a warning is logged
+when one statement runs many times in a request, which usually means an
+N+1 query pattern.
+
+Each gunicorn worker keeps its own metrics. Set PROMETHEUS_MULTIPROC_DIR
+to an empty, writable directory before the workers start to have /metrics
+aggregate all of them.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import current_app, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+)
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+REQUEST_COUNT = Counter(
+    "customers_http_requests_total",
+    "HTTP requests by resource method and status code",
+    ["resource", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "customers_http_request_duration_seconds",
+    "HTTP request latency by resource method",
+    ["resource"],
+)
+RESPONSE_SIZE = Histogram(
+    "customers_http_response_size_bytes",
+    "HTTP response body size by resource method",
+    ["resource"],
+    buckets=(128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, float("inf")),
+)
+DB_QUERIES = Histogram(
+    "customers_db_queries_per_request",
+    "SQL statements executed per request",
+    ["resource"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, float("inf")),
+)
+DB_DURATION = Histogram(
+    "customers_db_query_duration_seconds_per_request",
+    "Time spent in SQL statements per request",
+    ["resource"],
+)
+
+# The resource label, labelled counter and histograms of each (endpoint,
+# method, status), so a request costs one lookup: prometheus_client's
+# labels() is slower than observe()
+_request_metrics = {}
+# Statement lists of the active capture_queries blocks
+_captures = []
+# RequestStats of the request being handled, set between the request hooks.
+# A context variable is read much faster than flask.g, which matters for
+# the SQL hooks that run on every statement.
+_request_stats = ContextVar("request_stats", default=None)
+
+
+class RequestStats:  # pylint: disable=too-few-public-methods
+    """Per-request start time and SQL counters"""
+
+    __slots__ = ("started", "query_count", "query_seconds", "statements")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.query_seconds = 0.0
+        # Times each SQL statement ran, to spot N+1 patterns
+        self.statements = {}
+
+
+class StatsCollector:
+    """Publishes the Customer cache and connection pool counters of this worker"""
+
+    def collect(self):
+        """Yields the current cache and pool values as gauges"""
+        # pylint: disable=import-outside-toplevel
+        from service.common.db_pool import pool_stats
+        from service.models import Customer
+
+        worker = str(os.getpid())
+        for prefix, stats in (("customers_cache", Customer.cache.stats()),
+                              ("customers_db_pool", pool_stats.snapshot())):
+            for name, value in stats.items():
+                gauge = GaugeMetricFamily(f"{prefix}_{name}", f"Current {prefix} {name}", labels=["worker"])
+                gauge.add_metric([worker], value)
+                yield gauge
+
+
+def resource_label(app, endpoint, method):
+    """Returns the resource method handling a request, e.g. CustomerResource.get"""
+    view_class = getattr(app.view_functions.get(endpoint), "view_class", None)
+    if view_class is not None:
+        return f"{view_class.__name__}.{method.lower()}"
+    return endpoint or "unmatched"
+
+
+def request_metrics(app, endpoint, method, status_code):
+    """Returns the label, counter and histograms of a request, cached"""
+    key = (endpoint, method, status_code)
+    metrics = _request_metrics.get(key)
+    if metrics is None:
+        label = resource_label(app, endpoint, method)
+        metrics = _request_metrics[key] = (label, REQUEST_COUNT.labels(label, str(status_code))) + tuple(
+            metric.labels(label) for metric in (REQUEST_LATENCY, RESPONSE_SIZE, DB_QUERIES, DB_DURATION)
+        )
+    return metrics
+
+
+def request_stats():
+    """Returns the RequestStats of the current request, if any"""
+    return _request_stats.get()
+
+
+######################################################################
+# Request and SQL hooks
+######################################################################
+def before_request():
+    """Starts the clock and the SQL counters for a request"""
+    _request_stats.set(RequestStats())
+
+
+def after_request(response):
+    """Records the request count, latency, response size and SQL usage"""
+    stats = _request_stats.get()
+    if stats is None:
+        return response
+    elapsed = time.perf_counter() - stats.started
+    _request_stats.set(None)
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    req = request._get_current_object()  # pylint: disable=protected-access
+    label, counter, latency, size, queries, duration = request_metrics(
+        app, req.endpoint, req.method, response.status_code
+    )
+    latency.observe(elapsed)
+    counter.inc()
+    if not response.is_streamed:
+        size.observe(response.content_length or 0)
+    queries.observe(stats.query_count)
+    duration.observe(stats.query_seconds)
+    config = app.config
+    if config["QUERY_COUNT_HEADER"]:
+        response.headers["X-Query-Count"] = str(stats.query_count)
+    # Nothing is logged unless DEBUG is on or enough statements ran for one
+    # to repeat, so most requests skip formatting and scanning them
+    logger = app.extensions["metrics"]
+    repeat_warning = config["QUERY_REPEAT_WARNING"]
+    if logger.isEnabledFor(logging.DEBUG) or 0 < repeat_warning <= stats.query_count:
+        log_queries(logger, label, response.status_code, stats, repeat_warning)
+    return response
+
+
+def log_queries(logger, label, status_code, stats, repeat_warning):
+    """Logs the SQL usage of a request and warns about repeated statements"""
+    logger.debug(
+        "%s returned %d after %d queries (%.1f ms in SQL)",
+        label, status_code, stats.query_count, stats.query_seconds * 1000,
+    )
+    if not repeat_warning:
+        return
+    for statement, count in stats.statements.items():
+        if count >= repeat_warning:
+            logger.warning(
+                "%s ran the same statement %d times, a likely N+1 query: %s",
+                label, count, " ".join(statement.split())[:200],
+            )
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument, too-many-arguments
+    """Notes when a SQL statement starts"""
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # pylint: disable=unused-argument, too-many-arguments
+    """Adds a finished SQL statement to the counters of the current request"""
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    for captured in _captures:
+        captured.append(statement)
+    stats = request_stats()
+    if stats is not None:
+        stats.query_count += 1
+        stats.query_seconds += elapsed
+        stats.statements[statement] = stats.statements.get(statement, 0) + 1
+
+
+@contextmanager
+def capture_queries():
+    """Collects the SQL statements run inside the block, in any thread
+
+    Tests use it to hold endpoints to a query budget.
+    """
+    captured = []
+    _captures.append(captured)
+    try:
+        yield captured
+    finally:
+        _captures.remove(captured)
+
+
+######################################################################
+# Setup and exposition
+######################################################################
+def init_metrics(app):
+    """Registers the request and SQL hooks on the Flask app"""
+    # Flask's app.logger takes a lock on every access
+    app.extensions["metrics"] = app.logger
+    app.before_request(before_request)
+    app.after_request(after_request)
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+    app.logger.info("Metrics collection established")
+
+
+def render():
+    """Returns the metrics of this worker, or of all workers, in text format"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    output = generate_latest(registry)
+    extra = CollectorRegistry()
+    extra.register(StatsCollector())
+    return output + generate_latest(extra)
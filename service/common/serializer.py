@@ -0,0 +1,84 @@
+"""
+Serializer
+
+This module compiles a function that turns an object (or a dictionary)
+straight into JSON text in one pass, instead of building a dictionary,
+copying it through flask-restx marshalling and encoding that.
+
+A field is a (name, kind) pair where kind is one of "str", "int", "bool"
+or "datetime". The optional "orjson" backend builds a dictionary and lets
+orjson encode it when that package is installed.
+"""
+import keyword
+from json.encoder import encode_basestring_ascii
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+KINDS = {
+    "str": "_encode_string(str({v}))",
+    "int": "str(int({v}))",
+    "bool": "('true' if {v} else 'false')",
+    "datetime": "('\"' + {v}.isoformat() + '\"')",
+}
+
+# orjson encodes str, int, bool and datetime natively
+ORJSON_KINDS = {
+    "str": "str({v})",
+    "int": "int({v})",
+    "bool": "bool({v})",
+    "datetime": "{v}",
+}
+
+
+def available_backends():
+    """Returns the JSON backends that can be used here"""
+    return ("builtin", "orjson") if orjson is not None else ("builtin",)
+
+
+def compile_serializer(fields, getter="attr", backend="builtin"):
+    """
+    Compiles a function that serializes one object into JSON text
+
+    Args:
+        fields (list): (name, kind) pairs in output order
+        getter (str): "attr" to read obj.name or "item" to read obj["name"]
+        backend (str): "builtin" to build the text directly or "orjson"
+    """
+    if backend not in available_backends():
+        raise ValueError(f"JSON backend '{backend}' is not available")
+    lines = ["def serialize(obj):"]
+    for index, (name, kind) in enumerate(fields):
+        if not name.isidentifier() or keyword.iskeyword(name) or kind not in KINDS:
+            raise ValueError(f"Cannot serialize field '{name}' of kind '{kind}'")
+        access = f"obj.{name}" if getter == "attr" else f"obj[{name!r}]"
+        lines.append(f"    v{index} = {access}")
+
+    if backend == "orjson":
+        items = ", ".join(
+            f"{name!r}: None if v{index} is None else {ORJSON_KINDS[kind].format(v=f'v{index}')}"
+            for index, (name, kind) in enumerate(fields)
+        )
+        lines.append(f"    return _orjson_dumps({{{items}}}).decode('utf-8')")
+    else:
+        parts = []
+        for index, (name, kind) in enumerate(fields):
+            separator = "{" if index == 0 else ","
+            parts.append(repr(f"{separator}\"{name}\":"))
+            parts.append(f"('null' if v{index} is None else {KINDS[kind].format(v=f'v{index}')})")
+        parts.append("'}'")
+        lines.append(f"    return ''.join(({', '.join(parts)}))")
+
+    namespace = {
+        "_encode_string": encode_basestring_ascii,
+        "_orjson_dumps": orjson.dumps if orjson is not None else None,
+    }
+    exec("\n".join(lines), namespace)  # pylint: disable=exec-used
+    return namespace["serialize"]
+
+
+def json_array(documents):
+    """Joins already serialized JSON documents into a JSON array"""
+    return "[" + ",".join(documents) + "]"
@@ -12,5 +12,83 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Database URI of the ASGI entry point (service/asgi.py). Defaults to
+# DATABASE_URI with the asyncpg or aiosqlite driver
+ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URI", "")
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Keyset pagination for collection listings
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Counts for X-Total-Count: planner estimates below this many rows are
+# replaced with an exact COUNT(*)
+COUNT_EXACT_THRESHOLD = int(os.getenv("COUNT_EXACT_THRESHOLD", "10000"))
+
+# Number of rows fetched per server-side cursor batch when streaming
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+# Maximum number of Customers accepted by one bulk request
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "1000"))
+
+# Number of Customers removed by each DELETE statement of a bulk delete
+BULK_DELETE_BATCH_SIZE = int(os.getenv("BULK_DELETE_BATCH_SIZE", "500"))
+
+# Typeahead search: the shortest text accepted, the default and largest
+# number of results, and how many matches of each tier are ranked at most
+SEARCH_MIN_LENGTH = int(os.getenv("SEARCH_MIN_LENGTH", "3"))
+SEARCH_LIMIT_DEFAULT = int(os.getenv("SEARCH_LIMIT_DEFAULT", "10"))
+SEARCH_LIMIT_MAX = int(os.getenv("SEARCH_LIMIT_MAX", "50"))
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "1000"))
+
+# Read-through cache for single Customer lookups. Each gunicorn worker has
+# its own cache, so the TTL bounds how stale another worker's copy can be
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "1024"))
+CUSTOMER_CACHE_TTL = float(os.getenv("CUSTOMER_CACHE_TTL", "2.0"))
+
+# Database connection pool. Size it so that
+#   workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) <= Postgres max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "2"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "yes", "1")
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "customers")
+
+if DATABASE_URI.startswith("postgres"):
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "connect_args": {
+            "connect_timeout": DB_CONNECT_TIMEOUT,
+            "application_name": DB_APPLICATION_NAME,
+            "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+        },
+    }
+else:
+    # Other databases (SQLite in tests) keep the driver's default pool
+    SQLALCHEMY_ENGINE_OPTIONS = {"pool_pre_ping": DB_POOL_PRE_PING}
+
+# Per-request SQL instrumentation: send the query count in an X-Query-Count
+# header, and warn when one statement runs this many times in a request
+# (a likely N+1 query; 0 turns the warning off)
+QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER", "false").lower() in ("true", "yes", "1")
+QUERY_REPEAT_WARNING = int(os.getenv("QUERY_REPEAT_WARNING", "5"))
+
+# Response compression: the encodings offered, most preferred first (zstd
+# needs the zstandard package, an empty list turns compression off), the
+# smallest body compressed and the compression levels
+COMPRESS_ENCODINGS = os.getenv("COMPRESS_ENCODINGS", "zstd,gzip,deflate")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_ZSTD_LEVEL = int(os.getenv("COMPRESS_ZSTD_LEVEL", "3"))
+
+# JSON encoder for responses: "builtin" or "orjson" (needs the orjson package)
+JSON_ENCODER = os.getenv("JSON_ENCODER", "builtin")
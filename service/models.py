@@ -3,11 +3,27 @@ Models for YourResourceModel
 
 All of the models are stored in this module
 """
+import json
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from datetime import date, datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
+from sqlalchemy.orm.exc import StaleDataError
 from . import app
+from .common.db_pool import InstrumentedQueuePool, pool_stats
+from .common.serializer import compile_serializer
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Instances are not expired on commit: serializing a Customer right after
+# saving it would otherwise SELECT it again. Sessions end with each request
+db = SQLAlchemy(session_options={"expire_on_commit": False})
 
 
 class DatabaseConnectionError(Exception):
@@ -18,22 +34,169 @@ class DataValidationError(Exception):
     """ Used for data validation errors when deserializing """
 
 
+class DataConflictError(Exception):
+    """ Used when a write collides with a unique constraint """
+
+
+def is_unique_violation(error):
+    """Checks if an IntegrityError was raised by a unique constraint"""
+    pgcode = getattr(error.orig, "pgcode", None)
+    if pgcode is not None:
+        return pgcode == "23505"  # unique_violation
+    return "UNIQUE" in str(error.orig).upper()
+
+
+def integrity_error(error, conflict_message):
+    """Rolls back after an IntegrityError and returns the matching model error"""
+    db.session.rollback()
+    if is_unique_violation(error):
+        return DataConflictError(conflict_message)
+    return DataValidationError(f"Invalid Customer: {error.orig}")
+
+
+def supports_returning():
+    """Checks if the database can return rows from UPDATE and DELETE"""
+    return getattr(db.engine.dialect, "full_returning", False)
+
+
+# Customers inserted by each statement of Customer.create_many
+CREATE_MANY_BATCH_SIZE = 1000
+
+# Most sparse fieldset serializers kept compiled, see Customer.serializer
+FIELD_SERIALIZERS_MAX = 256
+
+# Renders statements with :name placeholders, which text() can take back
+NAMED_PARAMS_DIALECT = postgresql.dialect(paramstyle="named")
+
+
+def make_etag(customer_id, version):
+    """Builds a strong entity tag (unquoted) from a Customer id and version"""
+    return f"{customer_id}-{version}"
+
+
+def to_bool(value):
+    """Converts a boolean or a true/false string into a boolean"""
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("true", "yes", "1"):
+        return True
+    if str(value).lower() in ("false", "no", "0"):
+        return False
+    raise DataValidationError(f"Invalid boolean value '{value}'")
+
+
+class CustomerCache:
+    """
+    In-process LRU cache with a time-to-live for serialized Customers
+
+    Any object with the same get/set/delete/clear/stats methods can be
+    swapped in with Customer.set_cache, for example one backed by Redis.
+    A max_size or ttl of 0 disables caching.
+    """
+
+    def __init__(self, max_size=1024, ttl=2.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached value for key or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Caches a value, evicting the least recently used entries when full"""
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Removes a key from the cache"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit, miss and eviction counters and the current size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+            }
+
+
 class Customer(db.Model):
     """
     Class that represents a customers
     """
 
     app = None
+    cache = CustomerCache()
+
+    # Columns that can be filtered on, with the normalization applied to
+    # values so they match the way the routes store them
+    FILTERS = {
+        "firstname": str.title,
+        "lastname": str.title,
+        "city": str.title,
+        "email": str.lower,
+        "state": str,
+        "country": str,
+        "zipcode": str,
+        "acc_active": to_bool,
+    }
+    FILTER_OPERATORS = ("eq", "in", "prefix")
+    # Columns set from a request body by deserialize
+    WRITABLE_COLUMNS = (
+        "firstname", "lastname", "email", "phone", "street_line1", "street_line2",
+        "city", "state", "country", "zipcode", "acc_active",
+    )
+    # Stored case of the names, city and email, which keeps lookups on them
+    # case insensitive with plain indexes
+    NORMALIZERS = {
+        "firstname": str.title,
+        "lastname": str.title,
+        "city": str.title,
+        "email": str.lower,
+    }
+    # Columns matched by search, in the order of search_expression
+    SEARCH_COLUMNS = ("firstname", "lastname", "email", "city")
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    firstname = db.Column(db.String(63), nullable=False)
-    lastname = db.Column(db.String(63), nullable=False)
-    email = db.Column(db.String(120), nullable=False)
+    # firstname, lastname and city are stored title-cased and email lower-cased
+    # so the finders can use plain btree indexes on the columns
+    firstname = db.Column(db.String(63), nullable=False, index=True)
+    lastname = db.Column(db.String(63), nullable=False, index=True)
+    email = db.Column(db.String(120), nullable=False, unique=True)
     phone = db.Column(db.String(30), nullable=False)
     street_line1 = db.Column(db.String(256), nullable=False)
     street_line2 = db.Column(db.String(256), nullable=False)
-    city = db.Column(db.String(64), nullable=False)
+    city = db.Column(db.String(64), nullable=False, index=True)
     state = db.Column(db.String(46), nullable=False)
     country = db.Column(db.String(93), nullable=False)
     zipcode = db.Column(db.String(20), nullable=False)
@@ -42,9 +205,16 @@ class Customer(db.Model):
         db.DateTime,
         nullable=False,
         server_default=db.func.now(),
-        server_onupdate=db.func.now()
+        onupdate=db.func.now()
         )
     acc_active = db.Column(db.Boolean, server_default=db.true(), nullable=False)
+    # Bumped on every UPDATE and checked in its WHERE clause so concurrent
+    # writers cannot silently overwrite each other; also used for ETags
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+
+    # eager_defaults loads created_at/updated_at in the INSERT or UPDATE
+    # itself (RETURNING) so nothing is left to refresh afterwards
+    __mapper_args__ = {"version_id_col": version, "eager_defaults": True}
 
     def __repr__(self):
         cust = "<Customer %r id=[%s] acc_active=[%s]>" % (self.firstname, self.id, self.acc_active)
@@ -57,7 +227,8 @@ class Customer(db.Model):
         app.logger.info("Creating %s", self.firstname)
         self.id = None  # id must be none to generate next primary key
         db.session.add(self)
-        db.session.commit()
+        self._commit()
+        self.cache.delete(str(self.id))
 
     def update(self):
         """
@@ -66,13 +237,126 @@ class Customer(db.Model):
         app.logger.info("Saving %s", self.firstname)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
-        db.session.commit()
+        self._commit()
+        self.cache.delete(str(self.id))
 
     def delete(self):
         """ Removes a Customer from the data store """
         app.logger.info("Deleting %s", self.firstname)
+        customer_id = self.id
         db.session.delete(self)
         db.session.commit()
+        self.cache.delete(str(customer_id))
+
+    def _commit(self):
+        """Commits the session, turning constraint violations into model errors"""
+        # Build the messages first since the instance expires on rollback
+        conflict_message = f"Another Customer with email '{self.email}' found."
+        stale_message = f"Customer with id '{self.id}' was changed by another request."
+        try:
+            db.session.commit()
+        except IntegrityError as error:
+            raise integrity_error(error, conflict_message) from error
+        except StaleDataError as error:
+            db.session.rollback()
+            raise DataConflictError(stale_message) from error
+
+    @property
+    def etag(self):
+        """Returns the entity tag for the current version of this Customer"""
+        return make_etag(self.id, self.version)
+
+    def to_json(self):
+        """Serializes a Customer straight into JSON text in one pass"""
+        return self._json_serializer(self)
+
+    @classmethod
+    def row_to_json(cls, row):
+        """Serializes a row returned by a Core statement into JSON text"""
+        return cls._json_serializer(row)
+
+    def normalize(self):
+        """Title-cases the names and city and lower-cases the email"""
+        try:
+            for column, normalize in self.NORMALIZERS.items():
+                setattr(self, column, normalize(getattr(self, column)))
+        except TypeError as error:
+            raise DataValidationError(
+                "Invalid Customer: names, city and email must be strings"
+            ) from error
+        return self
+
+    @classmethod
+    def partial_values(cls, data):
+        """
+        Validates and normalizes the columns of a partial update (PATCH)
+
+        Only the fields present in the document are returned, so only they
+        are written.
+
+        Args:
+            data (dict): some of the WRITABLE_COLUMNS and their new values
+
+        Returns:
+            dict: the normalized values by column
+        """
+        if not isinstance(data, dict) or not data:
+            raise DataValidationError("Invalid Customer: body of request must be a non-empty object")
+        unknown = set(data).difference(cls.WRITABLE_COLUMNS)
+        if unknown:
+            raise DataValidationError(f"Invalid Customer: cannot update {', '.join(sorted(unknown))}")
+        values = {}
+        for column, value in data.items():
+            if column == "acc_active":
+                values[column] = to_bool(value)
+            elif isinstance(value, str):
+                values[column] = cls.NORMALIZERS.get(column, str)(value)
+            else:
+                raise DataValidationError(f"Invalid Customer: {column} must be a string")
+        return values
+
+    @classmethod
+    def create_many(cls, customers):
+        """
+        Creates many Customers in a single transaction
+
+        Each batch of CREATE_MANY_BATCH_SIZE Customers is one multi-row
+        INSERT. Where the database supports RETURNING it returns the new ids,
+        otherwise they are read back with one SELECT by email, so the number
+        of statements does not grow with the size of a batch.
+
+        Returns:
+            list: the ids assigned to the Customers, in order
+        """
+        app.logger.info("Creating %d Customers", len(customers))
+        table = cls.__table__
+        ids = []
+        try:
+            for start in range(0, len(customers), CREATE_MANY_BATCH_SIZE):
+                batch = customers[start:start + CREATE_MANY_BATCH_SIZE]
+                rows = [customer.column_values() for customer in batch]
+                for row in rows:
+                    # A multi-row INSERT cannot leave a column to its server default
+                    if row["acc_active"] is None:
+                        row["acc_active"] = True
+                statement = table.insert().values(rows)
+                if supports_returning():
+                    result = db.session.execute(statement.returning(table.c.id, table.c.email))
+                else:
+                    db.session.execute(statement)
+                    result = db.session.execute(
+                        db.select(table.c.id, table.c.email).where(table.c.email.in_([row["email"] for row in rows]))
+                    )
+                # Emails are unique, unlike the order of returned rows
+                by_email = {email: customer_id for customer_id, email in result}
+                ids.extend(by_email[row["email"]] for row in rows)
+            db.session.commit()
+        except IntegrityError as error:
+            raise integrity_error(error, "Another Customer with one of the emails was found.") from error
+        for customer, customer_id in zip(customers, ids):
+            customer.id = customer_id
+            cls.cache.delete(str(customer_id))
+        return ids
 
     def serialize(self):
         """ Serializes a Customer into a dictionary """
@@ -122,19 +406,202 @@ class Customer(db.Model):
 
     @classmethod
     def init_db(cls, app):
-        """ Initializes the database session """
+        """ Initializes the database session without connecting """
         app.logger.info("Initializing database")
         cls.app = app
-        # This is where we initialize SQLAlchemy from the Flask app
+        cls.set_cache(CustomerCache(app.config["CUSTOMER_CACHE_SIZE"], app.config["CUSTOMER_CACHE_TTL"]))
+        if make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() == "postgresql":
+            # Count checkout waits and saturation for the pool sized in config
+            options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+            options.setdefault("poolclass", InstrumentedQueuePool)
+        # This is where we initialize SQLAlchemy from the Flask app. No
+        # connection is made until the first query, see create_schema
         db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
 
     @classmethod
-    def all(cls):
+    def create_schema(cls, app):
+        """Creates the tables and indexes that do not exist yet"""
+        app.logger.info("Creating database schema")
+        with app.app_context():
+            db.create_all()
+            cls.upgrade_schema()
+
+    @classmethod
+    def upgrade_schema(cls):
+        """
+        Brings a customer table created before the version column up to date
+
+        create_all never alters an existing table, so this adds the version
+        column and the indexes, and makes emails unique: every Customer but
+        the first (lowest id) with the same email, ignoring case, is deleted.
+        It runs in one transaction, once: afterwards the version column exists.
+        """
+        table = cls.__table__
+        columns = {column["name"] for column in db.inspect(db.engine).get_columns(table.name)}
+        if "version" in columns:
+            return
+        app.logger.warning("Upgrading the %s table to the current schema", table.name)
+        with db.engine.begin() as conn:
+            deleted = conn.execute(db.text(
+                f"DELETE FROM {table.name} WHERE id NOT IN "
+                f"(SELECT min(id) FROM {table.name} GROUP BY lower(email))"
+            )).rowcount
+            app.logger.warning("Deleted %d Customers with duplicate emails", deleted)
+            normalized = ["email = lower(email)"]
+            if conn.dialect.name == "postgresql":
+                # initcap is the SQL counterpart of str.title
+                normalized += [f"{column} = initcap({column})" for column in ("firstname", "lastname", "city")]
+            conn.execute(db.text(f"UPDATE {table.name} SET {', '.join(normalized)}"))
+            conn.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN version integer NOT NULL DEFAULT 1"))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+            # The name PostgreSQL gives the unique constraint of a new table
+            conn.execute(db.text(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {table.name}_email_key ON {table.name} (email)"
+            ))
+
+    @classmethod
+    def dispose_engine(cls, app, close=True):
+        """
+        Drops every pooled database connection
+
+        Args:
+            close (bool): False in a forked child, so the connections it
+                inherited are forgotten without closing them for the parent
+        """
+        pool_stats.reset()
+        with app.app_context():
+            db.engine.dispose(close=close)
+        cls.cache.clear()
+
+    @classmethod
+    def paginate(cls, query, limit=None, after_id=None):
+        """Applies keyset pagination to a query
+
+        Rows are returned in id order starting after ``after_id`` so every page
+        is an indexed range scan on the primary key instead of an OFFSET scan.
+
+        Args:
+            query (Query): the query to paginate
+            limit (int): the maximum number of Customers to return
+            after_id (int): only return Customers with an id greater than this
+        """
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        query = query.order_by(cls.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    @classmethod
+    def build_filters(cls, criteria):
+        """Builds SQL conditions from a list of filter criteria
+
+        Args:
+            criteria (list): (field, operator, value) tuples where operator is
+                one of FILTER_OPERATORS and value is a list for "in"
+        """
+        clauses = []
+        for field, operator, value in criteria:
+            if field not in cls.FILTERS:
+                raise DataValidationError(f"Cannot filter Customers by '{field}'")
+            if operator not in cls.FILTER_OPERATORS:
+                raise DataValidationError(f"Unsupported filter operator '{operator}' for '{field}'")
+            normalize = cls.FILTERS[field]
+            column = getattr(cls, field)
+            if operator == "in":
+                clauses.append(column.in_([normalize(item) for item in value]))
+            elif operator == "prefix":
+                if normalize is to_bool:
+                    raise DataValidationError(f"Cannot prefix match on '{field}'")
+                clauses.append(column.startswith(normalize(value), autoescape=True))
+            else:
+                clauses.append(column == normalize(value))
+        return clauses
+
+    @classmethod
+    def find_by_filters(cls, criteria, limit=None, after_id=None):
+        """Returns all Customers matching every one of the filter criteria
+
+        Args:
+            criteria (list): (field, operator, value) tuples, see build_filters
+            limit (int): the maximum number of Customers to return
+            after_id (int): only return Customers with an id greater than this
+        """
+        app.logger.info("Processing filter query for %s ...", criteria)
+        query = cls.query.filter(*cls.build_filters(criteria))
+        return cls.paginate(query, limit, after_id)
+
+    @classmethod
+    def search_expression(cls):
+        """Returns the lower-cased SEARCH_COLUMNS joined by spaces, as SQL
+
+        This must stay the same expression as the one indexed by
+        SEARCH_INDEX_DDL or Postgres will not use the index.
+        """
+        text = getattr(cls, cls.SEARCH_COLUMNS[0])
+        for name in cls.SEARCH_COLUMNS[1:]:
+            text = text + " " + getattr(cls, name)
+        return db.func.lower(text)
+
+    @classmethod
+    def search(cls, text, limit=10, candidates=1000):
+        """Returns the Customers whose name, email or city contain some text
+
+        Customers where a column equals the text come first, then those
+        where a column starts with it, then the rest; on Postgres each tier
+        is ordered by trigram similarity. Each tier is filled separately
+        with up to ``candidates`` matches, so a short, common text cannot
+        sort the table nor crowd the exact and prefix matches out.
+
+        Args:
+            text (str): the text to look for, ignoring case
+            limit (int): the maximum number of Customers to return
+            candidates (int): the maximum number of matches to rank per tier
+        """
+        app.logger.info("Processing search for %s ...", text)
+        text = text.strip().lower()
+        # A literal pattern rather than autoescape's '%' || :text || '%' keeps
+        # the LIKE plannable against the trigram index
+        escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        document = cls.search_expression()
+        contains = document.like(f"%{escaped}%", escape="\\")
+        columns = [getattr(cls, name) for name in cls.SEARCH_COLUMNS]
+        # The columns are stored normalized, so exact matches use their indexes
+        exact = db.or_(*(column == cls.NORMALIZERS[column.key](text) for column in columns))
+        prefix = db.or_(*(db.func.lower(column).like(f"{escaped}%", escape="\\") for column in columns))
+        # The tiers do not overlap, so each one has its own candidates
+        conditions = (exact, db.and_(contains, prefix, db.not_(exact)), db.and_(contains, db.not_(prefix)))
+        tiers = [
+            db.select(cls.id, db.literal(rank).label("rank")).where(condition).limit(candidates).subquery()
+            for rank, condition in enumerate(conditions)
+        ]
+        ranked = db.union_all(*(db.select(*tier.c) for tier in tiers)).subquery()
+        order = [ranked.c.rank]
+        if db.engine.dialect.name == "postgresql":
+            order.append(db.func.similarity(document, text).desc())
+        order.append(cls.id)
+        return cls.query.join(ranked, cls.id == ranked.c.id).order_by(*order).limit(limit)
+
+    @classmethod
+    def stream(cls, query, batch_size=1000):
+        """Yields the Customers of a query in fixed-size batches
+
+        A server-side cursor is used where the driver supports one so that
+        only ``batch_size`` rows are held in memory at any time.
+
+        Args:
+            query (Query): the query to stream
+            batch_size (int): the number of rows to fetch per round-trip
+        """
+        app.logger.info("Streaming Customers in batches of %d", batch_size)
+        return query.execution_options(stream_results=True).yield_per(batch_size)
+
+    @classmethod
+    def all(cls, limit=None, after_id=None):
         """ Returns all of the Customers in the database """
         app.logger.info("Processing all YourResourceModels")
-        return cls.query.all()
+        return cls.paginate(cls.query, limit, after_id).all()
 
     @classmethod
     def find(cls, by_id):
@@ -143,40 +610,440 @@ class Customer(db.Model):
         return cls.query.get(by_id)
 
     @classmethod
-    def find_by_firstname(cls, firstname):
+    def find_cached(cls, by_id):
+        """Returns a Customer by it's ID as JSON, reading through the cache
+
+        Returns:
+            tuple: the Customer's (etag, json) or None if it was not found
+        """
+        key = str(by_id)
+        entry = cls.cache.get(key)
+        if entry is None:
+            customer = cls.find(by_id)
+            if customer is None:
+                return None
+            entry = (customer.etag, customer.to_json())
+            cls.cache.set(key, entry)
+        return entry
+
+    @classmethod
+    def find_many_cached(cls, ids):
+        """Returns many Customers by their IDs as JSON, reading through the cache
+
+        The Customers that are not cached are read with a single IN query.
+
+        Args:
+            ids (list): the ids of the Customers, which may repeat
+
+        Returns:
+            list: the Customer's (etag, json) for each id in order, or None
+                where it was not found
+        """
+        entries = {str(by_id): None for by_id in ids}
+        for key in entries:
+            entries[key] = cls.cache.get(key)
+        missing = [key for key, entry in entries.items() if entry is None]
+        if missing:
+            app.logger.info("Processing lookup of %d Customers ...", len(missing))
+            for customer in cls.query.filter(cls.id.in_([int(key) for key in missing])):
+                entry = (customer.etag, customer.to_json())
+                cls.cache.set(str(customer.id), entry)
+                entries[str(customer.id)] = entry
+        return [entries[str(by_id)] for by_id in ids]
+
+    def column_values(self):
+        """Returns the values a client can write as a dictionary of columns"""
+        return {column: getattr(self, column) for column in self.WRITABLE_COLUMNS}
+
+    @classmethod
+    def get_statement(cls, by_id, fields=None):
+        """Builds a Core SELECT of one Customer, of only some fields' columns if given"""
+        table = cls.__table__
+        columns = cls.field_columns(fields) if fields is not None else [table]
+        return db.select(*columns).where(table.c.id == by_id)
+
+    @classmethod
+    def select_statement(cls, criteria=None, limit=None, after_id=None, fields=None):
+        """Builds a Core SELECT for find_by_filters, see build_filters and paginate
+
+        Only the columns of some fields are selected if they are given.
+        """
+        table = cls.__table__
+        columns = cls.field_columns(fields) if fields is not None else [table]
+        statement = db.select(*columns).where(*cls.build_filters(criteria or []))
+        if after_id is not None:
+            statement = statement.where(table.c.id > after_id)
+        statement = statement.order_by(table.c.id)
+        if limit is not None:
+            statement = statement.limit(limit)
+        return statement
+
+    @classmethod
+    def count_statement(cls, criteria=None):
+        """Builds a SELECT COUNT(*) of the Customers matching the filter criteria"""
+        return db.select(db.func.count()).select_from(cls.__table__).where(*cls.build_filters(criteria or []))
+
+    @classmethod
+    def estimate_statement(cls, criteria, dialect):
+        """Builds a statement that estimates how many Customers match, see read_estimate
+
+        Without criteria the table's row count is read from pg_class; with
+        criteria the planner's row estimate for the SELECT is taken from
+        EXPLAIN. Neither reads any rows.
+
+        Returns:
+            TextClause: the statement, or None if the database has no estimates
+        """
+        if dialect.name != "postgresql":
+            return None
+        if not criteria:
+            return db.text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)").bindparams(
+                table=cls.__tablename__
+            )
+        select = db.select(cls.id).where(*cls.build_filters(criteria))
+        compiled = select.compile(dialect=NAMED_PARAMS_DIALECT, compile_kwargs={"render_postcompile": True})
+        return db.text(f"EXPLAIN (FORMAT JSON) {compiled}").bindparams(**compiled.params)
+
+    @staticmethod
+    def read_estimate(value):
+        """Returns the row count from the result of an estimate_statement"""
+        if isinstance(value, str):  # asyncpg does not decode the EXPLAIN json
+            value = json.loads(value)
+        if isinstance(value, list):
+            return int(value[0]["Plan"]["Plan Rows"])
+        # reltuples is -1 until the table is first vacuumed or analyzed
+        return max(int(value), 0)
+
+    @classmethod
+    def count(cls, criteria=None, estimate=False, exact_below=10000):
+        """Counts the Customers matching the filter criteria without fetching them
+
+        Args:
+            criteria (list): (field, operator, value) tuples, see build_filters
+            estimate (bool): use the planner's estimate on Postgres when it
+                is at least exact_below; smaller estimates, and every count
+                on other databases, are replaced with an exact COUNT(*)
+            exact_below (int): the estimate under which the count is exact
+
+        Returns:
+            tuple: the count and whether it is exact
+        """
+        app.logger.info("Processing count for %s ...", criteria)
+        if estimate:
+            statement = cls.estimate_statement(criteria, db.engine.dialect)
+            if statement is not None:
+                estimated = cls.read_estimate(db.session.execute(statement).scalar())
+                if estimated >= exact_below:
+                    return estimated, False
+        return db.session.execute(cls.count_statement(criteria)).scalar(), True
+
+    @classmethod
+    def update_statement(cls, by_id, values, versions=None):
+        """Builds the UPDATE of one Customer that also bumps its version
+
+        Args:
+            by_id (int): the id of the Customer to update
+            values (dict): the new column values
+            versions (list): only update the Customer at one of these versions
+        """
+        table = cls.__table__
+        statement = (
+            table.update()
+            .where(table.c.id == by_id)
+            .values(version=table.c.version + 1, updated_at=db.func.now(), **values)
+        )
+        if versions is not None:
+            statement = statement.where(table.c.version.in_(versions))
+        return statement
+
+    @classmethod
+    def delete_statement(cls, by_id, versions=None):
+        """Builds the DELETE of one Customer, optionally at some versions only"""
+        table = cls.__table__
+        statement = table.delete().where(table.c.id == by_id)
+        if versions is not None:
+            statement = statement.where(table.c.version.in_(versions))
+        return statement
+
+    @classmethod
+    def update_columns(cls, by_id, values, versions=None):
+        """
+        Updates some columns of a Customer with a single UPDATE statement
+
+        The version is bumped and updated_at refreshed in the same statement.
+        Where the database supports RETURNING the new row comes back from the
+        UPDATE itself, otherwise it is read back in the same transaction.
+
+        Args:
+            by_id (int): the id of the Customer to update
+            values (dict): the new column values
+            versions (list): only update the Customer at one of these versions
+
+        Returns:
+            Row: the updated row (with the same attributes as a Customer)
+                or None if there is no Customer with that id (and version)
+        """
+        app.logger.info("Updating %s of Customer %s ...", ", ".join(values), by_id)
+        table = cls.__table__
+        statement = cls.update_statement(by_id, values, versions)
+        try:
+            if supports_returning():
+                row = db.session.execute(statement.returning(*table.c)).first()
+            else:
+                result = db.session.execute(statement)
+                row = None
+                if result.rowcount:
+                    row = db.session.execute(table.select().where(table.c.id == by_id)).first()
+            db.session.commit()
+        except IntegrityError as error:
+            raise integrity_error(error, f"Another Customer with email '{values.get('email')}' found.") from error
+        if row is not None:
+            cls.cache.delete(str(row.id))
+        return row
+
+    @classmethod
+    def delete_by_id(cls, by_id, versions=None):
+        """
+        Deletes a Customer with a single DELETE statement
+
+        Args:
+            by_id (int): the id of the Customer to delete
+            versions (list): only delete the Customer if its version is one
+                of these, as sent in an If-Match header
+
+        Returns:
+            bool: True if a Customer was deleted
+        """
+        app.logger.info("Deleting Customer %s ...", by_id)
+        deleted = db.session.execute(cls.delete_statement(by_id, versions)).rowcount
+        db.session.commit()
+        cls.cache.delete(str(by_id))
+        return deleted > 0
+
+    @classmethod
+    def delete_many(cls, ids, batch_size=500):
+        """
+        Deletes Customers by id, one DELETE statement and commit per batch
+
+        Args:
+            ids (iterable): the ids of the Customers to delete, read lazily
+            batch_size (int): the number of ids in each DELETE statement
+
+        Yields:
+            tuple: the number of ids in each batch and of Customers deleted
+        """
+        table = cls.__table__
+        ids = iter(ids)
+        while True:
+            batch = list(islice(ids, batch_size))
+            if not batch:
+                return
+            deleted = db.session.execute(table.delete().where(table.c.id.in_(batch))).rowcount
+            db.session.commit()
+            for customer_id in batch:
+                cls.cache.delete(str(customer_id))
+            yield len(batch), deleted
+
+    @classmethod
+    def set_active_many(cls, active, ids=None, criteria=None):
+        """
+        Activates or deactivates many Customers with a single UPDATE statement
+
+        Args:
+            active (bool): the new account status
+            ids (list): the ids of the Customers to change
+            criteria (list): filter criteria as accepted by build_filters
+
+        Returns:
+            int: the number of Customers that were changed
+        """
+        conditions = []
+        if ids is not None:
+            conditions.append(cls.id.in_(ids))
+        if criteria:
+            conditions.extend(cls.build_filters(criteria))
+        if not conditions:
+            raise DataValidationError("Bulk account changes need ids or filters")
+        app.logger.info("Setting acc_active=%s for many Customers ...", active)
+        table = cls.__table__
+        statement = (
+            table.update()
+            .where(*conditions)
+            .values(acc_active=active, version=table.c.version + 1, updated_at=db.func.now())
+        )
+        # Clearing the cache is cheaper than returning every changed id
+        count = db.session.execute(statement).rowcount
+        db.session.commit()
+        cls.cache.clear()
+        return count
+
+    @classmethod
+    def json_fields(cls):
+        """Returns the (name, kind) pairs of the JSON representation
+
+        They are taken from the column list: ids are sent as strings like
+        the OpenAPI model documents and the row version only goes in ETags.
+        """
+        kinds = {str: "str", int: "int", bool: "bool", datetime: "datetime", date: "datetime"}
+        return [
+            (column.name, "str" if column.primary_key else kinds[column.type.python_type])
+            for column in cls.__table__.columns
+            if column.name != "version"
+        ]
+
+    @classmethod
+    def configure_serializer(cls, backend="builtin"):
+        """Compiles the JSON serializer used by to_json"""
+        cls._json_backend = backend
+        cls._json_kinds = dict(cls.json_fields())
+        cls._json_serializer = staticmethod(compile_serializer(cls.json_fields(), backend=backend))
+        cls._field_serializers = {}
+
+    @classmethod
+    def parse_fields(cls, fields):
+        """Validates the comma separated JSON field names of a sparse fieldset
+
+        Returns:
+            tuple: the names in the order of json_fields, or None for all fields
+        """
+        if fields is None:
+            return None
+        names = {name.strip() for name in fields.split(",") if name.strip()}
+        if not names:
+            raise DataValidationError("fields must name at least one field")
+        unknown = names.difference(cls._json_kinds)
+        if unknown:
+            raise DataValidationError(f"Unknown Customer fields: {', '.join(sorted(unknown))}")
+        return tuple(name for name in cls._json_kinds if name in names)
+
+    @classmethod
+    def serializer(cls, fields=None):
+        """Returns the JSON serializer of some fields, compiled once per fieldset
+
+        Args:
+            fields (tuple): field names from parse_fields, or None for all
+        """
+        if fields is None:
+            return cls._json_serializer
+        serializer = cls._field_serializers.get(fields)
+        if serializer is None:
+            serializer = compile_serializer(
+                [(name, cls._json_kinds[name]) for name in fields], backend=cls._json_backend
+            )
+            # Bound the cache since every combination of fields is valid
+            if len(cls._field_serializers) < FIELD_SERIALIZERS_MAX:
+                cls._field_serializers[fields] = serializer
+        return serializer
+
+    @classmethod
+    def load_fields(cls, query, fields):
+        """Restricts the columns a query loads to those of some fields
+
+        The primary key is always loaded so the Customers keep their identity.
+        """
+        if fields is None:
+            return query
+        return query.options(load_only(*(getattr(cls, name) for name in fields)))
+
+    @classmethod
+    def field_columns(cls, fields):
+        """Returns the table columns of some fields plus the id and version"""
+        names = dict.fromkeys(fields + ("id", "version"))
+        return [cls.__table__.c[name] for name in names]
+
+    @classmethod
+    def find_fields(cls, by_id, fields):
+        """Returns some JSON fields of a Customer, selecting only their columns
+
+        Returns:
+            tuple: the Customer's (etag, json) or None if it was not found
+        """
+        app.logger.info("Processing lookup of %s for id %s ...", fields, by_id)
+        row = db.session.execute(cls.get_statement(by_id, fields)).first()
+        if row is None:
+            return None
+        return make_etag(row.id, row.version), cls.serializer(fields)(row)
+
+    @classmethod
+    def set_cache(cls, cache):
+        """Replaces the cache used by find_cached"""
+        cls.cache = cache
+
+    @classmethod
+    def find_existing_emails(cls, emails):
+        """Returns the subset of the given emails that are already in use
+
+        Args:
+            emails (iterable): lower-cased emails to look up with one query
+        """
+        emails = set(emails)
+        app.logger.info("Processing lookup for %d emails ...", len(emails))
+        if not emails:
+            return set()
+        rows = db.session.query(cls.email).filter(cls.email.in_(emails))
+        return {email for (email,) in rows}
+
+    @classmethod
+    def find_by_firstname(cls, firstname, limit=None, after_id=None):
         """Returns all Customers with the given firstname
 
         Args:
             firstname (string): the firstname of the Customers you want to match
+            limit (int): the maximum number of Customers to return
+            after_id (int): only return Customers with an id greater than this
         """
         app.logger.info("Processing firstname query for %s ...", firstname)
-        return cls.query.filter(cls.firstname == firstname.title())
+        query = cls.query.filter(cls.firstname == firstname.title())
+        return cls.paginate(query, limit, after_id)
 
     @classmethod
-    def find_by_email(cls, email):
+    def find_by_email(cls, email, limit=None, after_id=None):
         """Returns the first Customer with the given email
 
         Args:
             email (string): the email of the Customers you want to match
+            limit (int): the maximum number of Customers to return
+            after_id (int): only return Customers with an id greater than this
         """
         app.logger.info("Processing email query for %s ...", email)
-        return cls.query.filter(cls.email == email.lower())
+        query = cls.query.filter(cls.email == email.lower())
+        return cls.paginate(query, limit, after_id)
 
     @classmethod
-    def find_by_lastname(cls, lastname):
+    def find_by_lastname(cls, lastname, limit=None, after_id=None):
         """Returns all Customers with the given lastname
 
         Args:
             lastname (string): the lastname of the Customers you want to match
+            limit (int): the maximum number of Customers to return
+            after_id (int): only return Customers with an id greater than this
         """
         app.logger.info("Processing lastname query for %s ...", lastname)
-        return cls.query.filter(cls.lastname == lastname.title())
+        query = cls.query.filter(cls.lastname == lastname.title())
+        return cls.paginate(query, limit, after_id)
 
     @classmethod
-    def find_by_city(cls, city):
+    def find_by_city(cls, city, limit=None, after_id=None):
         """Returns all Customers with the given city
         Args:
-            email (string): the email of the Customers you want to match
+            city (string): the city of the Customers you want to match
+            limit (int): the maximum number of Customers to return
+            after_id (int): only return Customers with an id greater than this
         """
         app.logger.info("Processing city query for %s ...", city)
-        return cls.query.filter(cls.city == city.title())
+        query = cls.query.filter(cls.city == city.title())
+        return cls.paginate(query, limit, after_id)
+
+
+# Trigram index behind Customer.search on Postgres, where it serves LIKE
+# '%text%' on the search expression. Other databases scan the table. The
+# statements run on every create_all so existing databases get the index
+SEARCH_INDEX_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_customer_search_trgm ON customer USING gin "
+    "(lower(firstname || ' ' || lastname || ' ' || email || ' ' || city) gin_trgm_ops)",
+)
+for search_ddl in SEARCH_INDEX_DDL:
+    event.listen(db.metadata, "after_create", DDL(search_ddl).execute_if(dialect="postgresql"))
+
+Customer.configure_serializer(app.config["JSON_ENCODER"])
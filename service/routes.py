@@ -5,9 +5,15 @@ Describe what your service does here
 """
 
 # from tkinter import E
-from flask import jsonify, request
-from flask_restx import fields, reqparse, Resource
-from service.models import Customer
+import base64
+import binascii
+import json
+from flask import Response, jsonify, request, stream_with_context
+from flask_restx import fields, inputs, reqparse, Resource
+from werkzeug.http import quote_etag
+from service.models import Customer, DataValidationError, make_etag
+from .common import metrics
+from .common.serializer import json_array
 from .common import status  # HTTP Status Codes
 
 # Import Flask application
@@ -41,8 +47,8 @@ create_model = api.model('Customer', {
     'state': fields.String(required=True, description='The state of the Customer'),
     'country': fields.String(required=True, description='The country of the Customer'),
     'zipcode': fields.String(required=True, description='The zipcode of the Customer'),
-    'created_at': fields.Date(required=True, description='The time when Customer was created'),
-    'updated_at': fields.Date(required=True, description='The time when Customer was deleted'),
+    'created_at': fields.DateTime(readOnly=True, description='The time when Customer was created'),
+    'updated_at': fields.DateTime(readOnly=True, description='The time when Customer was last updated'),
     'acc_active': fields.Boolean(required=True, description='Is the Customer account active'),
 })
 
@@ -54,7 +60,48 @@ customer_model = api.inherit(
     }
 )
 
+# Body of a partial update: any of the writable fields, none required
+patch_model = api.model('CustomerPatch', {
+    name: type(field)(description=field.description)
+    for name, field in create_model.items() if name in Customer.WRITABLE_COLUMNS
+})
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Path parameter of a single Customer. Parsing it to an int here gives every
+# spelling of an id ("01", "1") the same cache key, and anything that is not
+# an id in the range of the integer column is a 404.
+CUSTOMER_ID = "<int(max=2147483647):customer_id>"
+
+# Values of the count argument of the collection
+COUNT_MODES = ("exact", "estimated", "none")
+
+# Body of the bulk activate/deactivate requests
+bulk_active_model = api.model('BulkActive', {
+    'ids': fields.List(fields.Integer, description='The ids of the Customers to change'),
+    'filters': fields.Raw(description='Filters to select the Customers to change, '
+                                      'e.g. {"city": "London", "state__in": "NY,CA"}'),
+})
+
+# Body of the bulk delete request
+bulk_delete_model = api.model('BulkDelete', {
+    'ids': fields.List(fields.Integer, required=True, description='The ids of the Customers to delete'),
+})
+
+# Body and result of a multi-get
+mget_model = api.model('MultiGet', {
+    'ids': fields.List(fields.Integer, required=True, description='The ids of the Customers to read'),
+})
+
+mget_result_model = api.model('MultiGetResult', {
+    'id': fields.String(description='The requested id'),
+    'found': fields.Boolean(description='Whether a Customer has the id'),
+    'customer': fields.Nested(customer_model, description='The Customer, when found'),
+})
+
 # query string arguments
+# Filters can be combined and take an operator suffix: field=value (eq),
+# field__in=a,b,c or field__prefix=value
 customer_args = reqparse.RequestParser()
 customer_args.add_argument('firstname', type=str, location='args', required=False,
                            help='List Customers by first name')
@@ -64,6 +111,37 @@ customer_args.add_argument('city', type=str, location='args', required=False,
                            help='List Customers by city')
 customer_args.add_argument('email', type=str, location='args', required=False,
                            help='List Customers by email')
+customer_args.add_argument('state', type=str, location='args', required=False,
+                           help='List Customers by state')
+customer_args.add_argument('country', type=str, location='args', required=False,
+                           help='List Customers by country')
+customer_args.add_argument('zipcode', type=str, location='args', required=False,
+                           help='List Customers by zipcode')
+customer_args.add_argument('acc_active', type=inputs.boolean, location='args', required=False,
+                           help='List Customers by account status')
+customer_args.add_argument('limit', type=int, location='args', required=False,
+                           help='Maximum number of Customers to return per page')
+customer_args.add_argument('cursor', type=str, location='args', required=False,
+                           help='Opaque cursor taken from the rel="next" Link header')
+customer_args.add_argument('stream', type=inputs.boolean, location='args', required=False,
+                           help='Stream every matching Customer as NDJSON')
+customer_args.add_argument('fields', type=str, location='args', required=False,
+                           help='Comma separated fields to return, e.g. id,email,acc_active')
+customer_args.add_argument('count', type=str, location='args', required=False, choices=COUNT_MODES,
+                           help='Send the number of matching Customers in X-Total-Count: exact, '
+                                'estimated (exact for small counts) or none')
+
+# query string arguments of a single Customer
+customer_get_args = reqparse.RequestParser()
+customer_get_args.add_argument('fields', type=str, location='args', required=False,
+                               help='Comma separated fields to return, e.g. id,email,acc_active')
+
+# query string arguments of the typeahead search
+search_args = reqparse.RequestParser()
+search_args.add_argument('q', type=str, location='args', required=True,
+                         help='Text to look for in the first name, last name, email and city')
+search_args.add_argument('limit', type=int, location='args', required=False,
+                         help='Maximum number of Customers to return')
 
 ############################################################
 # H E A L T H   E N D P O I N TS
@@ -76,6 +154,12 @@ def health():
     app.logger.info("Service active, health endpoint successfully called")
     return jsonify(dict(status="OK")), status.HTTP_200_OK
 
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics"""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
@@ -87,17 +171,155 @@ def abort(error_code: int, message: str):
     api.abort(error_code, message)
 
 
-def check_for_dupe_emails(customer_email):
+def json_response(body, code=status.HTTP_200_OK, headers=None):
+    """Wraps JSON text that is already serialized in a response"""
+    return Response(body, status=code, headers=headers, mimetype="application/json")
+
+
+def check_if_match(customer):
+    """Aborts with 412 when an If-Match header does not match the Customer"""
+    if not request.if_match:
+        return
+    if customer is None or not request.if_match.contains(customer.etag):
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "The Customer does not match the If-Match header.",
+        )
+
+
+def is_digits(text):
+    """Checks that text is only ASCII digits, unlike isdigit() which accepts '²'"""
+    return text.isascii() and text.isdecimal()
+
+
+def if_match_versions(if_match, customer_id):
+    """Returns the Customer versions an If-Match header allows, or None for any
+
+    ETags are "<id>-<version>", so tags for other Customers match nothing.
     """
-    Retrieve a single Customer by email address
-    This endpoint will return a Customer based on it's email
+    if not if_match or if_match.star_tag:
+        return None
+    prefix = f"{customer_id}-"
+    return [
+        int(tag[len(prefix):]) for tag in if_match.as_set()
+        if tag.startswith(prefix) and is_digits(tag[len(prefix):])
+    ]
+
+
+def parse_ids(ids):
+    """Validates a list of Customer ids sent in a bulk request body"""
+    # Customers are returned with string ids so accept those too
+    if not isinstance(ids, list) or not all(is_digits(str(item)) for item in ids):
+        abort(status.HTTP_400_BAD_REQUEST, "ids must be a list of integers.")
+    if len(ids) > app.config['BULK_MAX_ITEMS']:
+        abort(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            f"Bulk changes accept at most {app.config['BULK_MAX_ITEMS']} ids.",
+        )
+    return [int(item) for item in ids]
+
+
+def encode_cursor(last_id):
+    """Encodes the id of the last Customer on a page into an opaque cursor"""
+    raw = json.dumps({"id": last_id}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor back into the id of the last Customer seen"""
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))["id"])
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid cursor '{cursor}'.")
+    return None
+
+
+def next_page_link(last_id, limit):
+    """Builds the rel="next" Link header value for the page after last_id"""
+    params = request.args.to_dict()
+    params.update(limit=limit, cursor=encode_cursor(last_id))
+    url = api.url_for(CustomerCollection, _external=True, **params)
+    return f'<{url}>; rel="next"'
+
+
+def parse_filters(args, strict=False):
+    """Turns field[__operator]=value arguments into filter criteria
+
+    Arguments that are not filters are skipped unless strict is set,
+    in which case they are rejected.
     """
-    app.logger.info("Request for Customer with email: %s", customer_email)
-    # See if the Customer exists
-    customer = Customer.find_by_email(customer_email).first()
-    if customer:
+    criteria = []
+    for key, value in args.items():
+        field, _, operator = key.partition("__")
+        if field not in Customer.FILTERS:
+            if strict:
+                raise DataValidationError(f"Cannot filter Customers by '{field}'")
+            continue
+        operator = operator or "eq"
+        if operator == "in" and isinstance(value, str):
+            value = [item for item in value.split(",") if item]
+        criteria.append((field, operator, value))
+    return criteria
+
+
+def bulk_set_active(active):
+    """Activates or deactivates the Customers selected by the request body"""
+    payload = api.payload
+    if not isinstance(payload, dict) or not (payload.get("ids") or payload.get("filters")):
+        abort(status.HTTP_400_BAD_REQUEST, "Send a list of ids or a dictionary of filters.")
+    ids = payload.get("ids")
+    if ids is not None:
+        ids = parse_ids(ids)
+    filters = payload.get("filters")
+    if filters is not None and not isinstance(filters, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "filters must be a dictionary.")
+    criteria = parse_filters(filters, strict=True) if filters else None
+    affected = Customer.set_active_many(active, ids=ids, criteria=criteria)
+    app.logger.info("Set acc_active=%s on %d Customers", active, affected)
+    return {'affected': affected}, status.HTTP_200_OK
+
+
+def count_headers(criteria, mode):
+    """Counts the Customers matching the criteria into X-Total-Count headers
+
+    Args:
+        criteria (list): the filter criteria, see parse_filters
+        mode (str): one of COUNT_MODES
+    """
+    if mode == "none":
+        return {}
+    total, exact = Customer.count(criteria, mode == "estimated", app.config['COUNT_EXACT_THRESHOLD'])
+    return total_count_headers(total, exact)
+
+
+def total_count_headers(total, exact):
+    """Returns the X-Total-Count headers of a count"""
+    headers = {'X-Total-Count': str(total)}
+    if not exact:
+        headers['X-Total-Count-Estimated'] = 'true'
+    return headers
+
+
+def wants_ndjson(args):
+    """Checks if the client asked for a streamed NDJSON response"""
+    if args['stream']:
         return True
-    return False
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_ndjson(query, headers=None, serialize=Customer.to_json):
+    """Streams the Customers of a query as one JSON document per line"""
+    batch_size = app.config['STREAM_BATCH_SIZE']
+
+    def generate():
+        count = 0
+        for customer in Customer.stream(query, batch_size):
+            count += 1
+            yield serialize(customer) + "\n"
+        app.logger.info("Streamed %d customers", count)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE, headers=headers)
 
 
 def init_db():
@@ -110,7 +332,7 @@ def init_db():
 ######################################################################
 
 
-@api.route('/customers/<customer_id>')
+@api.route(f'/customers/{CUSTOMER_ID}')
 @api.param('customer_id', 'The Customer identifier')
 class CustomerResource(Resource):
     """
@@ -118,6 +340,7 @@ class CustomerResource(Resource):
     Allows the manipulation of a single Customer
     GET /customer{id} - Returns a Customer with the id
     PUT /customer{id} - Update a Customer with the id
+    PATCH /customer{id} - Update some fields of a Customer with the id
     DELETE /customer{id} -  Deletes a Customer with the id
     """
 
@@ -125,8 +348,11 @@ class CustomerResource(Resource):
     # RETRIEVE A CUSTOMER
     # ------------------------------------------------------------------
     @api.doc('get_customers')
+    @api.expect(customer_get_args, validate=True)
+    @api.response(400, 'Unknown fields were requested')
     @api.response(404, 'Customer not found')
-    @api.marshal_with(customer_model)
+    @api.response(304, 'Customer not modified since the If-None-Match ETag')
+    @api.response(200, 'Success', customer_model)
     def get(self, customer_id):
         """
         Retrieve a single Customer
@@ -134,12 +360,24 @@ class CustomerResource(Resource):
         """
         app.logger.info("Request for Customer with id: %s", customer_id)
 
+        # Sparse fieldsets select only their columns and skip the cache,
+        # which holds whole Customers
+        fields = Customer.parse_fields(customer_get_args.parse_args()['fields'])
+        if fields is None:
+            customer = Customer.find_cached(customer_id)
+        else:
+            customer = Customer.find_fields(customer_id, fields)
         # See if the Customer exists and abort if it doesn't
-        customer = Customer.find(customer_id)
         if not customer:
             abort(status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found.",)
 
-        return customer.serialize(), status.HTTP_200_OK
+        etag, body = customer
+        # A partial representation only gets a weak ETag, good for
+        # If-None-Match but not for If-Match
+        headers = {'ETag': quote_etag(etag, weak=fields is not None)}
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return json_response(body, status.HTTP_200_OK, headers)
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING CUSTOMER
@@ -148,8 +386,10 @@ class CustomerResource(Resource):
     # @app.route("/api/customers/<int:customer_id>", methods=["PUT"])
     @api.doc('update_customer')
     @api.response(404, 'Customer not found')
+    @api.response(409, 'Customer was changed by another request')
+    @api.response(412, 'Customer does not match the If-Match ETag')
     @api.expect(customer_model)
-    @api.marshal_with(customer_model)
+    @api.response(200, 'Success', customer_model)
     def put(self, customer_id):
         """
         Update a customer's personal data.
@@ -163,29 +403,65 @@ class CustomerResource(Resource):
             abort(
                 status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found."
             )
+        check_if_match(customer_account)
 
         # Update from the json in the body of the request
-        customer_account.deserialize(request.get_json())
-        customer_account.id = customer_id
-        customer_account.lastname = customer_account.lastname.title()
-        customer_account.email = customer_account.email.lower()
-        customer_account.city = customer_account.city.title()
+        customer_account.deserialize(request.get_json()).normalize()
         customer_account.update()
-        return customer_account.serialize(), status.HTTP_200_OK
+        body = customer_account.to_json()
+        return json_response(body, status.HTTP_200_OK, {'ETag': quote_etag(customer_account.etag)})
+
+    # ------------------------------------------------------------------
+    # PARTIALLY UPDATE AN EXISTING CUSTOMER
+    # ------------------------------------------------------------------
+    @api.doc('patch_customer')
+    @api.response(400, 'The posted data was not valid')
+    @api.response(404, 'Customer not found')
+    @api.response(409, 'Another Customer has the email')
+    @api.response(412, 'Customer does not match the If-Match ETag')
+    @api.expect(patch_model)
+    @api.response(200, 'Success', customer_model)
+    def patch(self, customer_id):
+        """
+        Update some of a customer's data
+        This endpoint will update only the fields present in the body that is posted
+        """
+        app.logger.info("Request to patch the customer with id: %s", customer_id)
+        values = Customer.partial_values(request.get_json())
+        # The If-Match check is part of the UPDATE statement itself
+        versions = if_match_versions(request.if_match, customer_id)
+        customer = Customer.update_columns(customer_id, values, versions)
+        if not customer:
+            # Only a failed update pays for finding out why
+            if versions is not None and Customer.find(customer_id):
+                abort(
+                    status.HTTP_412_PRECONDITION_FAILED,
+                    "The Customer does not match the If-Match header.",
+                )
+            abort(status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found.")
+
+        headers = {'ETag': quote_etag(make_etag(customer.id, customer.version))}
+        return json_response(Customer.row_to_json(customer), status.HTTP_200_OK, headers)
 
     # ------------------------------------------------------------------
     # DELETE A CUSTOMER
     # ------------------------------------------------------------------
     @api.doc('delete_customers')
     @api.response(204, 'Customer deleted')
+    @api.response(412, 'Customer does not match the If-Match ETag')
     def delete(self, customer_id):
         """
         Delete a Customer
         """
         app.logger.info("Request to delete customer with id: %s", customer_id)
-        customer = Customer.find(customer_id)
-        if customer:
-            customer.delete()
+        # The If-Match check is part of the DELETE statement itself
+        deleted = Customer.delete_by_id(customer_id, if_match_versions(request.if_match, customer_id))
+        if request.if_match and not deleted:
+            abort(
+                status.HTTP_412_PRECONDITION_FAILED,
+                "The Customer does not match the If-Match header.",
+            )
+        if deleted:
             app.logger.info("Customer with ID [%s] delete complete.",
                             customer_id)
         return "", status.HTTP_204_NO_CONTENT
@@ -205,31 +481,66 @@ class CustomerCollection(Resource):
 
     @api.doc('list_customers')
     @api.expect(customer_args, validate=True)
-    @api.marshal_list_with(customer_model)
+    @api.header('X-Total-Count', 'The number of matching Customers, with the count argument')
+    @api.response(200, 'Success', [customer_model])
+    @api.produces(['application/json', NDJSON_MIMETYPE])
     def get(self):
         """Returns all of the Customers"""
         app.logger.info("Request for all Customers")
-        customers = []
         args = customer_args.parse_args()
-        if args['lastname']:
-            app.logger.info(f'Filtering by lastname: {args["lastname"]}')
-            customers = Customer.find_by_lastname(args['lastname'])
-        elif args['firstname']:
-            app.logger.info(f'Filtering by firstname: {args["firstname"]}')
-            customers = Customer.find_by_firstname(args['firstname'])
-        elif args['city']:
-            app.logger.info(f'Filtering by city: {args["city"]}')
-            customers = Customer.find_by_city(args['city'])
-        elif args['email']:
-            app.logger.info(f'Filtering by email: {args["email"]}')
-            customers = Customer.find_by_email(args["email"])
+        limit = args['limit'] if args['limit'] is not None else app.config['PAGE_SIZE_DEFAULT']
+        if not 1 <= limit <= app.config['PAGE_SIZE_MAX']:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"limit must be between 1 and {app.config['PAGE_SIZE_MAX']}.",
+            )
+        after_id = decode_cursor(args['cursor']) if args['cursor'] else None
+        streaming = wants_ndjson(args)
+        if streaming:
+            # Streams are not paged unless the client asks for a limit
+            page = {'limit': args['limit'], 'after_id': after_id}
         else:
-            app.logger.info('Returning unfiltered list.')
-            customers = Customer.all()
+            # Fetch one extra row to find out if there is a next page
+            page = {'limit': limit + 1, 'after_id': after_id}
+        criteria = parse_filters(request.args)
+        app.logger.info("Filtering by %s", criteria)
+        headers = count_headers(criteria, args['count'] or 'none')
+        fields = Customer.parse_fields(args['fields'])
+        customers = Customer.load_fields(Customer.find_by_filters(criteria, **page), fields)
+        serialize = Customer.serializer(fields)
+
+        if streaming:
+            return stream_ndjson(customers, headers, serialize)
+
+        customers = customers.all()
+        if len(customers) > limit:
+            customers = customers[:limit]
+            headers['Link'] = next_page_link(customers[-1].id, limit)
+
+        app.logger.info("Returning %d customers", len(customers))
+        body = json_array(serialize(customer) for customer in customers)
+        return json_response(body, status.HTTP_200_OK, headers)
 
-        results = [customer.serialize() for customer in customers]
-        app.logger.info("Returning %d customers", len(results))
-        return results, status.HTTP_200_OK
+    # ------------------------------------------------------------------
+    # COUNT CUSTOMERS
+    # ------------------------------------------------------------------
+    @api.doc('count_customers')
+    @api.expect(customer_args, validate=True)
+    @api.header('X-Total-Count', 'The number of matching Customers')
+    @api.header('X-Total-Count-Estimated', 'Set to true when the count is an estimate')
+    @api.response(200, 'The count is in the X-Total-Count header')
+    def head(self):
+        """
+        Counts the Customers
+        This endpoint sends the number of Customers matching the filters in
+        the X-Total-Count header without reading them. Counts are estimated
+        unless count=exact is given
+        """
+        app.logger.info("Request to count Customers")
+        args = customer_args.parse_args()
+        criteria = parse_filters(request.args)
+        headers = count_headers(criteria, args['count'] or 'estimated')
+        return Response(status=status.HTTP_200_OK, headers=headers)
 
     # ------------------------------------------------------------------
     # CREATE A NEW CUSTOMER
@@ -237,7 +548,7 @@ class CustomerCollection(Resource):
     @api.doc('create_customers')
     @api.response(400, 'The posted data was not valid')
     @api.expect(create_model)
-    @api.marshal_with(customer_model, code=201)
+    @api.response(201, 'Customer created', customer_model)
     def post(self):
         """
         Creates a Customer
@@ -248,34 +559,185 @@ class CustomerCollection(Resource):
         customer = Customer()
         app.logger.debug('Payload = %s', api.payload)
         customer.deserialize(api.payload)
+        customer.normalize()
 
-        # Setting to lower case for optimal possible case insensitive email queries later on
-        customer.email = customer.email.lower()
-        # Setting to title case for optimal possible case insensitive
-        # lastname and city queries later on
-        customer.lastname = customer.lastname.title()
-        customer.firstname = customer.firstname.title()
-        customer.city = customer.city.title()
-
-        if check_for_dupe_emails(customer.email):
-            abort(
-                status.HTTP_409_CONFLICT,
-                f"Another Customer with email '{customer.email}' found.",
-            )
-
+        # The unique constraint on email rejects duplicates with a 409
         customer.create()
         # Create a message to return
-        # message = customer.serialize()
         location_url = api.url_for(CustomerResource, customer_id=customer.id, _external=True)
 
         app.logger.info('Customer with new id [%s] created!', customer.id)
-        return customer.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
+        return json_response(customer.to_json(), status.HTTP_201_CREATED, {'Location': location_url})
+
+
+######################################################################
+#  PATH: /customers/search
+######################################################################
+@api.route('/customers/search')
+class CustomerSearch(Resource):
+    """ Handles typeahead searches for Customers """
+
+    @api.doc('search_customers')
+    @api.expect(search_args, validate=True)
+    @api.response(400, 'The search text was too short or the limit out of range')
+    @api.response(200, 'Success', [customer_model])
+    def get(self):
+        """
+        Searches for Customers
+        This endpoint returns the Customers whose first name, last name, email
+        or city contain the text, best matches first
+        """
+        args = search_args.parse_args()
+        text = args['q'].strip()
+        app.logger.info("Request to search Customers for %s", text)
+        if len(text) < app.config['SEARCH_MIN_LENGTH']:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"q must be at least {app.config['SEARCH_MIN_LENGTH']} characters long.",
+            )
+        limit = args['limit'] if args['limit'] is not None else app.config['SEARCH_LIMIT_DEFAULT']
+        if not 1 <= limit <= app.config['SEARCH_LIMIT_MAX']:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"limit must be between 1 and {app.config['SEARCH_LIMIT_MAX']}.",
+            )
+        customers = Customer.search(text, limit, app.config['SEARCH_CANDIDATES']).all()
+        app.logger.info("Returning %d customers", len(customers))
+        return json_response(json_array(customer.to_json() for customer in customers))
+
+
+######################################################################
+#  PATH: /customers/bulk
+######################################################################
+@api.route('/customers/bulk')
+class CustomerBulkResource(Resource):
+    """ Handles creating many Customers in one request """
+
+    # ------------------------------------------------------------------
+    # CREATE MANY CUSTOMERS
+    # ------------------------------------------------------------------
+    @api.doc('bulk_create_customers')
+    @api.response(400, 'The posted data was not valid')
+    @api.response(413, 'Too many Customers in one request')
+    @api.expect([create_model])
+    def post(self):
+        """
+        Creates many Customers
+        This endpoint will create every valid Customer in the posted array and
+        return a status (201, 400 or 409) for each one in the order posted
+        """
+        payload = api.payload
+        app.logger.info("Request to bulk create Customers")
+        if not isinstance(payload, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Bulk create expects an array of Customers.")
+        if len(payload) > app.config['BULK_MAX_ITEMS']:
+            abort(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"Bulk create accepts at most {app.config['BULK_MAX_ITEMS']} Customers.",
+            )
+
+        results = [None] * len(payload)
+        valid = []
+        for index, data in enumerate(payload):
+            try:
+                valid.append((index, Customer().deserialize(data).normalize()))
+            except DataValidationError as error:
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'message': str(error)}
+
+        # One set query finds every email that is already taken
+        seen = Customer.find_existing_emails(customer.email for _, customer in valid)
+        new = []
+        for index, customer in valid:
+            if customer.email in seen:
+                results[index] = {
+                    'status': status.HTTP_409_CONFLICT,
+                    'message': f"Another Customer with email '{customer.email}' found.",
+                }
+                continue
+            seen.add(customer.email)
+            new.append((index, customer))
+
+        if new:
+            ids = Customer.create_many([customer for _, customer in new])
+            for (index, _), customer_id in zip(new, ids):
+                results[index] = {
+                    'status': status.HTTP_201_CREATED,
+                    'id': str(customer_id),
+                    'location': api.url_for(CustomerResource, customer_id=customer_id, _external=True),
+                }
+
+        app.logger.info("Bulk created %d of %d Customers", len(new), len(payload))
+        return results, status.HTTP_200_OK
+
+    # ------------------------------------------------------------------
+    # DELETE MANY CUSTOMERS
+    # ------------------------------------------------------------------
+    @api.doc('bulk_delete_customers')
+    @api.response(204, 'Customers deleted')
+    @api.response(400, 'The ids were not valid')
+    @api.response(413, 'Too many ids in one request')
+    @api.expect(bulk_delete_model)
+    def delete(self):
+        """
+        Deletes many Customers
+        This endpoint will delete every Customer in the posted list of ids, in
+        batches. Ids that do not exist are ignored, like single deletes.
+        """
+        app.logger.info("Request to bulk delete Customers")
+        payload = api.payload
+        if not isinstance(payload, dict) or "ids" not in payload:
+            abort(status.HTTP_400_BAD_REQUEST, "Send the list of ids to delete.")
+        ids = parse_ids(payload["ids"])
+        deleted = sum(
+            count for _, count in Customer.delete_many(ids, app.config['BULK_DELETE_BATCH_SIZE'])
+        )
+        app.logger.info("Bulk deleted %d of %d Customers", deleted, len(ids))
+        return "", status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+#  PATH: /customers/_mget
+######################################################################
+@api.route('/customers/_mget')
+class CustomerMultiGet(Resource):
+    """ Handles reading many Customers by id in one request """
+
+    # ------------------------------------------------------------------
+    # READ MANY CUSTOMERS
+    # ------------------------------------------------------------------
+    @api.doc('multi_get_customers')
+    @api.response(400, 'The ids were not valid')
+    @api.response(413, 'Too many ids in one request')
+    @api.expect(mget_model)
+    @api.response(200, 'Success', [mget_result_model])
+    def post(self):
+        """
+        Reads many Customers
+        This endpoint will return an entry for each posted id, in the order
+        posted, with the Customer or found set to false
+        """
+        app.logger.info("Request to read many Customers")
+        payload = api.payload
+        if not isinstance(payload, dict) or "ids" not in payload:
+            abort(status.HTTP_400_BAD_REQUEST, "Send the list of ids to read.")
+        ids = parse_ids(payload["ids"])
+        entries = Customer.find_many_cached(ids)
+
+        # The cached Customers are already JSON so they are embedded as they are
+        results = []
+        for customer_id, entry in zip(ids, entries):
+            if entry is None:
+                results.append(json.dumps({'id': str(customer_id), 'found': False}))
+            else:
+                results.append(f'{{"id":"{customer_id}","found":true,"customer":{entry[1]}}}')
+        app.logger.info("Found %d of %d Customers", sum(entry is not None for entry in entries), len(ids))
+        return json_response(json_array(results), status.HTTP_200_OK)
 
 
 ######################################################################
 #  PATH: /customers/{id}/activate
 ######################################################################
-@api.route('/customers/<customer_id>/active')
+@api.route(f'/customers/{CUSTOMER_ID}/active')
 @api.param('customer_id', 'The Customer identifier')
 class ActivateResource(Resource):
     """ Activate/Deactivate actions on Customers """
@@ -286,20 +748,20 @@ class ActivateResource(Resource):
 
     @api.doc('activate_customer')
     @api.response(404, 'Customer not found')
+    @api.response(200, 'Success', customer_model)
     def put(self, customer_id):
         """
         Activates a Customer
         This endpoint will Activate a Customer based on the id specified in the path
         """
         app.logger.info("Request to Activate a customer with id: %s", customer_id)
-        customer = Customer.find(customer_id)
+        customer = Customer.update_columns(customer_id, {'acc_active': True})
         if not customer:
             abort(status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found.")
 
-        customer.acc_active = True
-        customer.update()
         app.logger.info("Customer with ID [%s] activation complete.", customer_id)
-        return customer.serialize(), status.HTTP_200_OK
+        headers = {'ETag': quote_etag(make_etag(customer.id, customer.version))}
+        return json_response(Customer.row_to_json(customer), status.HTTP_200_OK, headers)
 
     # ------------------------------------------------------------------
     # DEACTIVATE A CUSTOMER
@@ -307,19 +769,59 @@ class ActivateResource(Resource):
 
     @api.doc('deactivate_customer')
     @api.response(404, 'Customer not found')
+    @api.response(200, 'Success', customer_model)
     def delete(self, customer_id):
         """
         Deactivate a Customer
         This endpoint will Deactivate a Customer based on the id specified in the path
         """
         app.logger.info("Request to Deactivate a customer with id: %s", customer_id)
-        customer = Customer.find(customer_id)
+        customer = Customer.update_columns(customer_id, {'acc_active': False})
         if not customer:
             abort(
                 status.HTTP_404_NOT_FOUND, f"Customer with id '{customer_id}' was not found."
             )
 
-        customer.acc_active = False
-        customer.update()
         app.logger.info("Customer with ID [%s] deactivate complete.", customer_id)
-        return customer.serialize(), status.HTTP_200_OK
+        headers = {'ETag': quote_etag(make_etag(customer.id, customer.version))}
+        return json_response(Customer.row_to_json(customer), status.HTTP_200_OK, headers)
+
+
+######################################################################
+#  PATH: /customers/active
+######################################################################
+@api.route('/customers/active')
+class ActivateCollection(Resource):
+    """ Activate/Deactivate actions on many Customers at once """
+
+    # ------------------------------------------------------------------
+    # ACTIVATE MANY CUSTOMERS
+    # ------------------------------------------------------------------
+
+    @api.doc('bulk_activate_customers')
+    @api.response(400, 'Neither ids nor valid filters were sent')
+    @api.expect(bulk_active_model)
+    def put(self):
+        """
+        Activates many Customers
+        This endpoint will Activate every Customer matching the ids or filters
+        in the body with one statement and return the number of rows affected
+        """
+        app.logger.info("Request to Activate many customers")
+        return bulk_set_active(True)
+
+    # ------------------------------------------------------------------
+    # DEACTIVATE MANY CUSTOMERS
+    # ------------------------------------------------------------------
+
+    @api.doc('bulk_deactivate_customers')
+    @api.response(400, 'Neither ids nor valid filters were sent')
+    @api.expect(bulk_active_model)
+    def delete(self):
+        """
+        Deactivates many Customers
+        This endpoint will Deactivate every Customer matching the ids or filters
+        in the body with one statement and return the number of rows affected
+        """
+        app.logger.info("Request to Deactivate many customers")
+        return bulk_set_active(False)
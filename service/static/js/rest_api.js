@@ -326,6 +326,51 @@ $(function () {
         removeAllNotifications()
     });
 
+    // Show Customers in the results table and copy the first to the form
+    function render_results(res) {
+        $("#search_results").empty();
+        let table = '<table class="table table-striped" cellpadding="10">'
+        table += '<thead><tr>'
+        table += '<th class="col-md-1">ID</th>'
+        table += '<th class="col-md-2">Firstname</th>'
+        table += '<th class="col-md-2">Lastname</th>'
+        table += '<th class="col-md-2">Email</th>'
+        table += '<th class="col-md-2">Phone</th>'
+        table += '<th class="col-md-2">Street_Line1</th>'
+        table += '<th class="col-md-2">Street_Line2</th>'
+        table += '<th class="col-md-2">City</th>'
+        table += '<th class="col-md-2">State</th>'
+        table += '<th class="col-md-2">Country</th>'
+        table += '<th class="col-md-2">Zipcode</th>'
+        table += '</tr></thead><tbody>'
+        let firstCustomer = "";
+        for(let i = 0; i < res.length; i++) {
+            let customer = res[i];
+            table +=  `<tr id="row_${i}">
+                      <td>${customer.id}</td>
+                      <td>${customer.firstname}</td>
+                      <td>${customer.lastname}</td>
+                      <td>${customer.email}</td>
+                      <td>${customer.phone}</td>
+                      <td>${customer.street_line1}</td>
+                      <td>${customer.street_line2}</td>
+                      <td>${customer.city}</td>
+                      <td>${customer.state}</td>
+                      <td>${customer.country}</td>
+                      <td>${customer.zipcode}</td></tr>`;
+            if (i == 0) {
+                firstCustomer = customer;
+            }
+        }
+        table += '</tbody></table>';
+        $("#search_results").append(table);
+
+        // copy the first result to the form
+        if (firstCustomer != "") {
+            update_form_data(firstCustomer)
+        }
+    }
+
     // ****************************************
     // Search for a Customer
     // ****************************************
@@ -375,48 +420,7 @@ $(function () {
         })
 
         ajax.done(function(res){
-            $("#search_results").empty();
-            let table = '<table class="table table-striped" cellpadding="10">'
-            table += '<thead><tr>'
-            table += '<th class="col-md-1">ID</th>'
-            table += '<th class="col-md-2">Firstname</th>'
-            table += '<th class="col-md-2">Lastname</th>'
-            table += '<th class="col-md-2">Email</th>'
-            table += '<th class="col-md-2">Phone</th>'
-            table += '<th class="col-md-2">Street_Line1</th>'
-            table += '<th class="col-md-2">Street_Line2</th>'
-            table += '<th class="col-md-2">City</th>'
-            table += '<th class="col-md-2">State</th>'
-            table += '<th class="col-md-2">Country</th>'
-            table += '<th class="col-md-2">Zipcode</th>'
-            table += '</tr></thead><tbody>'
-            let firstCustomer = "";
-            for(let i = 0; i < res.length; i++) {
-                let customer = res[i];
-                table +=  `<tr id="row_${i}">
-                          <td>${customer.id}</td>
-                          <td>${customer.firstname}</td>
-                          <td>${customer.lastname}</td>
-                          <td>${customer.email}</td>
-                          <td>${customer.phone}</td>
-                          <td>${customer.street_line1}</td>
-                          <td>${customer.street_line2}</td>
-                          <td>${customer.city}</td>
-                          <td>${customer.state}</td>
-                          <td>${customer.country}</td>
-                          <td>${customer.zipcode}</td></tr>`;
-                if (i == 0) {
-                    firstCustomer = customer;
-                }
-            }
-            table += '</tbody></table>';
-            $("#search_results").append(table);
-
-            // copy the first result to the form
-            if (firstCustomer != "") {
-                update_form_data(firstCustomer)
-            }
-
+            render_results(res)
             flash_message("Success")
         });
 
@@ -426,4 +430,40 @@ $(function () {
 
     });
 
+    // ****************************************
+    // Quick search as you type
+    // ****************************************
+
+    let quickSearchTimer = null;
+
+    $("#quick_search").on("input", function () {
+        clearTimeout(quickSearchTimer);
+        let text = $(this).val().trim();
+        if (text.length < 3) {
+            return;
+        }
+        // Wait for a pause in typing so each keystroke is not a request
+        quickSearchTimer = setTimeout(function () {
+            let ajax = $.ajax({
+                type: "GET",
+                url: "/api/customers/search?" + $.param({q: text}),
+                contentType: "application/json",
+                data: ''
+            })
+
+            ajax.done(function(res){
+                // Ignore answers to text that has since been changed
+                if ($("#quick_search").val().trim() != text) {
+                    return;
+                }
+                render_results(res)
+                flash_message("Success")
+            });
+
+            ajax.fail(function(res){
+                flash_message(res.responseJSON.message)
+            });
+        }, 250);
+    });
+
 })
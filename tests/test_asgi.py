@@ -0,0 +1,177 @@
+"""
+ASGI Entry Point Test Suite
+
+Runs the same requests as the Flask route tests against service.asgi
+"""
+import json
+from unittest import TestCase
+from starlette.testclient import TestClient
+from service import app as flask_app
+from service.asgi import app
+from service.models import Customer, db
+from service.common import status
+from tests.factories import CustomerFactory
+
+BASE_URL = "/api/customers"
+
+
+class TestAsgiServer(TestCase):
+    """ASGI Server Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Starts the app once so the async engine is shared by every test"""
+        cls.context = flask_app.app_context()
+        cls.context.push()
+        Customer.create_schema(flask_app)
+        cls.client = TestClient(app)
+        cls.client.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stops the app and disposes of the async engine"""
+        cls.client.__exit__(None, None, None)
+        cls.context.pop()
+
+    def setUp(self):
+        """This runs before each test"""
+        db.session.query(Customer).delete()  # clean up the last tests
+        db.session.commit()
+        Customer.cache.clear()
+
+    def tearDown(self):
+        """This runs after each test"""
+        db.session.remove()
+
+    def _create_customers(self, count):
+        """Creates customers through the async POST route"""
+        customers = []
+        for _ in range(count):
+            resp = self.client.post(BASE_URL, json=CustomerFactory().serialize())
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED, resp.text)
+            customers.append(resp.json())
+        return customers
+
+    def test_create_and_get_customer(self):
+        """It should Create a customer and Read it back with an ETag"""
+        customer = CustomerFactory(email="Ana@Example.COM", city="new york")
+        resp = self.client.post(BASE_URL, json=customer.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.json()
+        self.assertEqual(data["email"], "ana@example.com")
+        self.assertEqual(data["city"], "New York")
+        self.assertTrue(data["acc_active"])
+        self.assertTrue(resp.headers["Location"].endswith(f"{BASE_URL}/{data['id']}"))
+
+        resp = self.client.get(f"{BASE_URL}/{data['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json(), data)
+        etag = resp.headers["ETag"]
+        resp = self.client.get(f"{BASE_URL}/{data['id']}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.client.get(f"{BASE_URL}/0")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_customer_bad_request(self):
+        """It should not Create customers with bad data or duplicate emails"""
+        resp = self.client.post(BASE_URL, json={"name": "not enough data"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        # the same shape as a 400 from the Flask app's API
+        flask_resp = self.client.patch(f"{BASE_URL}/0", json={"name": "not enough data"})
+        self.assertEqual(flask_resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(resp.json()), set(flask_resp.json()))
+        self.assertEqual(resp.json()["status_code"], status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(BASE_URL, content="{}", headers={"Content-Type": "test/html"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        customer = self._create_customers(1)[0]
+        resp = self.client.post(BASE_URL, json=customer)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_update_customer(self):
+        """It should Update a customer only while its ETag matches If-Match"""
+        customer = self._create_customers(1)[0]
+        etag = self.client.get(f"{BASE_URL}/{customer['id']}").headers["ETag"]
+        customer["phone"] = "+15550001111"
+        resp = self.client.put(f"{BASE_URL}/{customer['id']}", json=customer, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.json()["phone"], "+15550001111")
+        resp = self.client.put(f"{BASE_URL}/{customer['id']}", json=customer, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.client.get(f"{BASE_URL}/{customer['id']}")
+        self.assertEqual(resp.json()["phone"], "+15550001111")
+        resp = self.client.put(f"{BASE_URL}/0", json=customer)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_customer(self):
+        """It should Delete a customer and keep deletes idempotent"""
+        customer = self._create_customers(1)[0]
+        resp = self.client.delete(f"{BASE_URL}/{customer['id']}", headers={"If-Match": '"0-0"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        for _ in range(2):
+            resp = self.client.delete(f"{BASE_URL}/{customer['id']}")
+            self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.client.get(f"{BASE_URL}/{customer['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_customers(self):
+        """It should List, filter, page, compress and stream customers"""
+        customers = self._create_customers(4)
+        resp = self.client.get(BASE_URL, params={"limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json(), customers[:2])
+        resp = self.client.get(resp.links["next"]["url"])
+        self.assertEqual(resp.json(), customers[2:])
+        self.assertNotIn("Link", resp.headers)
+
+        resp = self.client.get(BASE_URL, params={"email": customers[1]["email"].upper()})
+        self.assertEqual(resp.json(), [customers[1]])
+        resp = self.client.get(BASE_URL, params={"acc_active": "maybe"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        for limit in (0, "\u00b2"):
+            resp = self.client.get(BASE_URL, params={"limit": limit})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, limit)
+
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.json(), customers)
+
+        resp = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(resp.headers["Content-Type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line) for line in resp.text.splitlines()], customers)
+
+    def test_sparse_fieldsets(self):
+        """It should return only the requested fields of one or many customers"""
+        customers = self._create_customers(2)
+        resp = self.client.get(BASE_URL, params={"fields": "id,email"})
+        self.assertEqual(resp.json(), [{"id": c["id"], "email": c["email"]} for c in customers])
+        resp = self.client.get(f"{BASE_URL}/{customers[0]['id']}", params={"fields": "acc_active"})
+        self.assertEqual(resp.json(), {"acc_active": True})
+        self.assertTrue(resp.headers["ETag"].startswith("W/"))
+        resp = self.client.get(BASE_URL, params={"fields": "nope"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_count_customers(self):
+        """It should count Customers with HEAD or with the count argument"""
+        customers = self._create_customers(3)
+        resp = self.client.head(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["X-Total-Count"], "3")
+        resp = self.client.get(BASE_URL, params={"email": customers[0]["email"], "count": "exact"})
+        self.assertEqual(resp.headers["X-Total-Count"], "1")
+        self.assertEqual(resp.json(), customers[:1])
+        resp = self.client.get(BASE_URL, params={"count": "roughly"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_other_routes_fall_through_to_flask(self):
+        """It should serve the remaining routes with the Flask app"""
+        resp = self.client.get("/health")
+        self.assertEqual(resp.json(), {"status": "OK"})
+        customer = self._create_customers(1)[0]
+        resp = self.client.delete(f"{BASE_URL}/{customer['id']}/active")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get(f"{BASE_URL}/{customer['id']}")
+        self.assertFalse(resp.json()["acc_active"])
+        resp = self.client.patch(f"{BASE_URL}/{customer['id']}", json={"city": "boston"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()["city"], "Boston")
@@ -0,0 +1,121 @@
+"""
+Test cases for response compression
+"""
+import gzip
+import json
+import logging
+import zlib
+from unittest import TestCase, skipUnless
+from flask import Flask, Response, stream_with_context
+from werkzeug.datastructures import Accept
+from service.common import compression
+
+ROWS = [{"id": str(number), "email": f"customer{number}@example.com", "acc_active": True} for number in range(200)]
+
+
+def create_app(encodings="zstd,gzip,deflate"):
+    """Creates a small app with a large, a small and a streamed response"""
+    app = Flask(__name__)
+    app.logger.setLevel(logging.CRITICAL)
+    app.config.update(
+        COMPRESS_ENCODINGS=encodings, COMPRESS_MIN_SIZE=1024, COMPRESS_LEVEL=6, COMPRESS_ZSTD_LEVEL=3
+    )
+
+    @app.route("/large")
+    def large():
+        response = Response(json.dumps(ROWS), mimetype="application/json")
+        response.set_etag("1-1")
+        return response
+
+    @app.route("/small")
+    def small():
+        return Response(json.dumps(ROWS[:1]), mimetype="application/json")
+
+    @app.route("/stream")
+    def stream():
+        def generate():
+            for row in ROWS:
+                yield json.dumps(row) + "\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    @app.route("/image")
+    def image():
+        return Response(b"\x89PNG" * 1000, mimetype="image/png")
+
+    compression.init_compression(app)
+    return app
+
+
+class TestCompression(TestCase):
+    """Test the negotiated compression of responses"""
+
+    def setUp(self):
+        self.client = create_app().test_client()
+
+    def test_choose_encoding(self):
+        """It should pick the encoding with the best quality, then the server's preference"""
+        offered = ("zstd", "gzip", "deflate")
+        self.assertEqual(compression.choose_encoding(Accept([("gzip", 1), ("deflate", 1)]), offered), "gzip")
+        self.assertEqual(compression.choose_encoding(Accept([("gzip", 0.5), ("deflate", 1)]), offered), "deflate")
+        self.assertEqual(compression.choose_encoding(Accept([("*", 1)]), offered), "zstd")
+        self.assertEqual(compression.choose_encoding(Accept([("gzip", 0)]), offered), None)
+        self.assertEqual(compression.choose_encoding(Accept([("br", 1)]), offered), None)
+        self.assertEqual(compression.choose_encoding(Accept(), offered), None)
+
+    def test_gzip_and_deflate(self):
+        """It should compress large responses with gzip or deflate and weaken strong ETags"""
+        resp = self.client.get("/large", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.data))
+        self.assertEqual(json.loads(gzip.decompress(resp.data)), ROWS)
+        self.assertEqual(resp.headers["ETag"], 'W/"1-1"')
+        resp = self.client.get("/large", headers={"Accept-Encoding": "deflate"})
+        self.assertEqual(resp.headers["Content-Encoding"], "deflate")
+        self.assertEqual(json.loads(zlib.decompress(resp.data)), ROWS)
+
+    def test_no_compression(self):
+        """It should not compress small, binary or unrequested responses"""
+        resp = self.client.get("/small", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        resp = self.client.get("/large")
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.headers["ETag"], '"1-1"')
+        resp = self.client.get("/image", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        client = create_app(encodings="").test_client()
+        resp = client.get("/large", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_streamed_response(self):
+        """It should compress streamed responses chunk by chunk"""
+        resp = self.client.get("/stream", headers={"Accept-Encoding": "gzip"}, buffered=False)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        lines = gzip.decompress(b"".join(resp.response)).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], ROWS)
+
+    def test_compress_chunks(self):
+        """It should emit compressed data before the input is exhausted"""
+        consumed = []
+
+        def chunks():
+            for number in range(1000):
+                consumed.append(number)
+                yield zlib.compress(str(number).encode()) * 64
+
+        first = next(compression.compress_chunks(chunks(), "gzip", 6))
+        self.assertTrue(first)
+        self.assertLess(len(consumed), 1000)
+
+    @skipUnless("zstd" in compression.available_encodings(), "zstandard is not installed")
+    def test_zstd(self):
+        """It should prefer zstd when the client accepts it"""
+        import zstandard  # pylint: disable=import-outside-toplevel
+
+        resp = self.client.get("/large", headers={"Accept-Encoding": "gzip, zstd"})
+        self.assertEqual(resp.headers["Content-Encoding"], "zstd")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(resp.data)
+        self.assertEqual(json.loads(data), ROWS)
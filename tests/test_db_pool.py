@@ -0,0 +1,61 @@
+"""
+Test cases for the instrumented database connection pool
+"""
+import sqlite3
+from unittest import TestCase
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from service.common.db_pool import InstrumentedQueuePool, PoolStats, pool_stats
+
+
+class TestInstrumentedQueuePool(TestCase):
+    """Test the pool checkout counters"""
+
+    def setUp(self):
+        self.before = pool_stats.snapshot()
+        self.pool = InstrumentedQueuePool(
+            lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=0.05
+        )
+
+    def tearDown(self):
+        self.pool.dispose()
+
+    def test_checkout_is_counted(self):
+        """It should count checkouts and report the pool saturation"""
+        connection = self.pool.connect()
+        stats = pool_stats.snapshot()
+        self.assertEqual(stats["checkouts"], self.before["checkouts"] + 1)
+        self.assertEqual(stats["checked_out"], self.before["checked_out"] + 1)
+        self.assertEqual(stats["size"], self.before["size"] + 1)
+        connection.close()
+        self.assertEqual(pool_stats.snapshot()["checked_out"], self.before["checked_out"])
+
+    def test_checkout_timeout_is_counted(self):
+        """It should count checkouts that waited and timed out on a full pool"""
+        connection = self.pool.connect()
+        self.assertRaises(PoolTimeoutError, self.pool.connect)
+        stats = pool_stats.snapshot()
+        self.assertEqual(stats["timeouts"], self.before["timeouts"] + 1)
+        self.assertEqual(stats["waits"], self.before["waits"] + 1)
+        self.assertGreaterEqual(stats["max_wait_seconds"], 0.05)
+        connection.close()
+
+    def test_dispose_forgets_pool(self):
+        """It should stop reporting a pool once it is disposed"""
+        self.pool.dispose()
+        self.assertEqual(pool_stats.snapshot()["size"], self.before["size"])
+
+
+class TestPoolStats(TestCase):
+    """Test the pool counters on their own"""
+
+    def test_observe(self):
+        """It should sum wait times and keep the maximum"""
+        stats = PoolStats()
+        stats.observe(0.5, True)
+        stats.observe(0.25, False)
+        snapshot = stats.snapshot()
+        self.assertEqual(snapshot["checkouts"], 2)
+        self.assertEqual(snapshot["waits"], 1)
+        self.assertEqual(snapshot["wait_seconds"], 0.75)
+        self.assertEqual(snapshot["max_wait_seconds"], 0.5)
+        self.assertEqual(snapshot["size"], 0)
@@ -0,0 +1,112 @@
+"""
+Gunicorn Configuration Test Suite
+
+Tests the sizing of workers from cgroup limits in gunicorn.conf.py
+"""
+import os
+import importlib.util
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+CONF_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_conf():
+    """Loads gunicorn.conf.py, which is not importable by its file name"""
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", CONF_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+conf = load_conf()
+
+
+class TestGunicornConf(TestCase):
+    """Gunicorn configuration tests"""
+
+    def setUp(self):
+        """Creates an empty cgroup directory for each test"""
+        self.tmp = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, contents):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(contents + "\n")
+
+    def test_cgroup_v2_limits(self):
+        """It should read the CPU and memory limits of cgroup v2"""
+        self._write("cpu.max", "20000 100000")
+        self._write("memory.max", str(64 * 1024 * 1024))
+        self.assertAlmostEqual(conf.cpu_limit(self.root), 0.2)
+        self.assertEqual(conf.memory_limit(self.root), 64 * 1024 * 1024)
+        self._write("cpu.max", "max 100000")
+        self._write("memory.max", "max")
+        self.assertIsNone(conf.cpu_limit(self.root))
+        self.assertIsNone(conf.memory_limit(self.root))
+
+    def test_cgroup_v1_limits(self):
+        """It should read the CPU and memory limits of cgroup v1"""
+        self._write("cpu/cpu.cfs_quota_us", "150000")
+        self._write("cpu/cpu.cfs_period_us", "100000")
+        self._write("memory/memory.limit_in_bytes", str(512 * 1024 * 1024))
+        self.assertAlmostEqual(conf.cpu_limit(self.root), 1.5)
+        self.assertEqual(conf.memory_limit(self.root), 512 * 1024 * 1024)
+        self._write("cpu/cpu.cfs_quota_us", "-1")
+        self._write("memory/memory.limit_in_bytes", "9223372036854771712")
+        self.assertIsNone(conf.cpu_limit(self.root))
+        self.assertIsNone(conf.memory_limit(self.root))
+
+    def test_no_cgroup(self):
+        """It should report no limits without a cgroup filesystem"""
+        self.assertIsNone(conf.cpu_limit(self.root))
+        self.assertIsNone(conf.memory_limit(self.root))
+
+    def test_worker_count(self):
+        """It should size workers to the CPUs and fit them in memory"""
+        mib = 1024 * 1024
+        # The deployment's pods: 0.2 CPU and 64Mi
+        self.assertEqual(conf.worker_count(0.2, 64 * mib, 24), 1)
+        self.assertEqual(conf.worker_count(2, None, 24), 5)
+        self.assertEqual(conf.worker_count(2, 100 * mib, 24), 3)
+        self.assertEqual(conf.worker_count(4, 16 * mib, 24), 1)
+
+    def test_worker_exit_logs_memory(self):
+        """It should log the memory of an exiting worker"""
+        server = MagicMock()
+        worker = MagicMock(pid=42, nr=1000)
+        conf.worker_exit(server, worker)
+        message, *args = server.log.info.call_args[0]
+        self.assertIn("rss=", message)
+        self.assertEqual(args[:2], [42, 1000])
+
+    def test_child_exit_marks_metrics_dead(self):
+        """It should mark a dead worker's metrics only in multiprocess mode"""
+        worker = MagicMock(pid=42)
+        with patch("prometheus_client.multiprocess.mark_process_dead") as mark_process_dead:
+            with patch.dict(os.environ, {}, clear=False):
+                os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+                conf.child_exit(MagicMock(), worker)
+                mark_process_dead.assert_not_called()
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": self.root}):
+                conf.child_exit(MagicMock(), worker)
+                mark_process_dead.assert_called_once_with(42)
+
+    def test_on_starting_without_preload(self):
+        """It should create the schema in a child process without preload"""
+        server = MagicMock()
+        server.cfg.preload_app = False
+        with patch.object(conf.subprocess, "run") as run:
+            run.return_value.returncode = 0
+            conf.on_starting(server)
+            self.assertEqual(run.call_args[0][0][-3:], ["-m", "flask", "db-init"])
+            run.return_value.returncode = 1
+            with self.assertRaises(SystemExit) as context:
+                conf.on_starting(server)
+            self.assertEqual(context.exception.code, 4)
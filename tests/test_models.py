@@ -3,10 +3,13 @@ Test cases for Customer Model
 
 """
 import os
+import json
 import logging
 import unittest
+from sqlalchemy.dialects import postgresql
 from service import app
-from service.models import Customer, DataValidationError, db
+from service.models import Customer, CustomerCache, DataConflictError, DataValidationError, db
+from service.common import metrics
 from tests.factories import CustomerFactory
 
 DATABASE_URI = os.getenv(
@@ -28,17 +31,21 @@ class TestCustomer(unittest.TestCase):
         app.config["DEBUG"] = False
         app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
         app.logger.setLevel(logging.CRITICAL)
-        Customer.init_db(app)
+        cls.context = app.app_context()
+        cls.context.push()
+        Customer.create_schema(app)
 
     @classmethod
     def tearDownClass(cls):
         """ This runs once after the entire test suite """
         db.session.close()
+        cls.context.pop()
 
     def setUp(self):
         """ This runs before each test """
         db.session.query(Customer).delete()  # clean up the last tests
         db.session.commit()
+        Customer.cache.clear()
 
     def tearDown(self):
         """ This runs after each test """
@@ -160,6 +167,83 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(customers[0].id, original_id)
         self.assertEqual(customers[0].lastname, "Moreno")
 
+    def test_create_duplicate_email(self):
+        """It should not Create a Customer with an email that is already used"""
+        customer = CustomerFactory()
+        customer.create()
+        duplicate = CustomerFactory(email=customer.email)
+        self.assertRaises(DataConflictError, duplicate.create)
+        self.assertEqual(len(Customer.all()), 1)
+
+    def test_upgrade_schema(self):
+        """It should upgrade a table created before the version column and its indexes"""
+        table = Customer.__table__
+        # the customer table as the first release created it
+        old = db.Table(table.name, db.MetaData(), *(
+            db.Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+                      server_default=db.DefaultClause(column.server_default.arg) if column.server_default else None)
+            for column in table.columns if column.name != "version"
+        ))
+        db.session.remove()
+        table.drop(db.engine)
+        old.create(db.engine)
+        emails = ("Ann@Example.com", "ann@example.COM", "bo@x.com")
+        rows = [CustomerFactory(email=email, acc_active=True).serialize() for email in emails]
+        for row in rows:
+            del row["id"]
+        with db.engine.begin() as conn:
+            conn.execute(old.insert(), [{key: value for key, value in row.items() if key in old.c} for row in rows])
+        Customer.create_schema(app)
+        self.assertEqual(
+            [(customer.email, customer.version) for customer in Customer.query.order_by(Customer.id)],
+            [("ann@example.com", 1), ("bo@x.com", 1)],
+        )
+        indexes = {index["name"] for index in db.inspect(db.engine).get_indexes(table.name)}
+        self.assertLessEqual({index.name for index in table.indexes}, indexes)
+        self.assertRaises(DataConflictError, CustomerFactory(email="BO@x.com").normalize().create)
+        # an up to date table is left alone
+        Customer.create_schema(app)
+        self.assertEqual(Customer.query.count(), 2)
+
+    def test_create_many(self):
+        """It should Create many Customers with one INSERT and return their ids in order"""
+        customers = [CustomerFactory(acc_active=None) for _ in range(5)]
+        with metrics.capture_queries() as statements:
+            ids = Customer.create_many(customers)
+        self.assertEqual(len([sql for sql in statements if sql.startswith("INSERT")]), 1)
+        self.assertEqual(ids, [customer.id for customer in customers])
+        for customer_id, customer in zip(ids, customers):
+            found = Customer.find(customer_id)
+            self.assertEqual(found.email, customer.email)
+            self.assertTrue(found.acc_active)
+        self.assertRaises(DataConflictError, Customer.create_many, [CustomerFactory(email=customers[0].email)])
+
+    def test_create_with_missing_value(self):
+        """It should not Create a Customer with a null required column"""
+        customer = CustomerFactory(phone=None)
+        self.assertRaises(DataValidationError, customer.create)
+
+    def test_update_bumps_version(self):
+        """It should bump the version of a Customer on every Update"""
+        customer = CustomerFactory()
+        customer.create()
+        self.assertEqual(customer.version, 1)
+        etag = customer.etag
+        customer.phone = "+15550001111"
+        customer.update()
+        self.assertEqual(customer.version, 2)
+        self.assertNotEqual(customer.etag, etag)
+
+    def test_update_stale_customer(self):
+        """It should not Update a Customer that was changed by someone else"""
+        customer = CustomerFactory()
+        customer.create()
+        db.session.query(Customer).filter(Customer.id == customer.id).update(
+            {Customer.version: Customer.version + 1}, synchronize_session=False
+        )
+        customer.phone = "+15550001111"
+        self.assertRaises(DataConflictError, customer.update)
+
     def test_update_no_id(self):
         """It should not Update a Customer with no id"""
         customer = CustomerFactory()
@@ -176,6 +260,25 @@ class TestCustomer(unittest.TestCase):
         customer.delete()
         self.assertEqual(len(Customer.all()), 0)
 
+    def test_delete_by_id(self):
+        """It should Delete a Customer by id, optionally only at some versions"""
+        customer = CustomerFactory()
+        customer.create()
+        customer_id, version = customer.id, customer.version
+        self.assertFalse(Customer.delete_by_id(customer_id, [version + 1]))
+        self.assertTrue(Customer.delete_by_id(customer_id, [version]))
+        self.assertFalse(Customer.delete_by_id(customer_id))
+        self.assertEqual(Customer.all(), [])
+
+    def test_delete_many(self):
+        """It should Delete Customers by id in batches"""
+        for _ in range(5):
+            CustomerFactory().create()
+        ids = [customer.id for customer in Customer.all()]
+        batches = list(Customer.delete_many(iter(ids[:4] + [0]), batch_size=2))
+        self.assertEqual(batches, [(2, 2), (2, 2), (1, 0)])
+        self.assertEqual([customer.id for customer in Customer.all()], ids[4:])
+
     def test_list_all_customers(self):
         """It should List all Customers' in the database"""
         customers = Customer.all()
@@ -205,6 +308,7 @@ class TestCustomer(unittest.TestCase):
         self.assertEqual(data["country"], customer.country)
         self.assertEqual(data["zipcode"], customer.zipcode)
         self.assertEqual(data["acc_active"], customer.acc_active)
+        self.assertNotIn("version", data)
 
     def test_deserialize_a_customer(self):
         """It should de-serialize a Customer"""
@@ -265,3 +369,270 @@ class TestCustomer(unittest.TestCase):
         returned_customer = Customer.find_by_city(customer.city)[0]
         self.assertEqual(returned_customer.id, customer.id)
         self.assertEqual(returned_customer.city, customer.city)
+
+    def test_find_with_keyset_pagination(self):
+        """It should page through Customers in id order using a keyset"""
+        for _ in range(5):
+            CustomerFactory().create()
+        ids = [customer.id for customer in Customer.all()]
+        first_page = Customer.all(limit=2)
+        self.assertEqual([customer.id for customer in first_page], ids[:2])
+        second_page = Customer.all(limit=2, after_id=first_page[-1].id)
+        self.assertEqual([customer.id for customer in second_page], ids[2:4])
+        last_page = Customer.all(limit=2, after_id=second_page[-1].id)
+        self.assertEqual([customer.id for customer in last_page], ids[4:])
+
+    def test_find_by_lastname_with_keyset_pagination(self):
+        """It should page through Customers filtered by lastname"""
+        for _ in range(3):
+            customer = CustomerFactory(lastname="Perdomo")
+            customer.create()
+        CustomerFactory(lastname="Moreno").create()
+        page = Customer.find_by_lastname("perdomo", limit=2).all()
+        self.assertEqual(len(page), 2)
+        rest = Customer.find_by_lastname("perdomo", limit=2, after_id=page[-1].id).all()
+        self.assertEqual(len(rest), 1)
+        self.assertGreater(rest[0].id, page[-1].id)
+
+    def test_find_by_filters(self):
+        """It should Find Customers matching a combination of filters"""
+        CustomerFactory(lastname="Smith", city="London", state="EN").create()
+        CustomerFactory(lastname="Smith", city="Paris", state="FR").create()
+        CustomerFactory(lastname="Smithers", city="London", state="EN").create()
+        customers = Customer.find_by_filters(
+            [("lastname", "eq", "smith"), ("city", "eq", "london")]
+        ).all()
+        self.assertEqual(len(customers), 1)
+        self.assertEqual(customers[0].city, "London")
+        customers = Customer.find_by_filters([("lastname", "prefix", "smi")]).all()
+        self.assertEqual(len(customers), 3)
+        customers = Customer.find_by_filters(
+            [("state", "in", ["EN", "XX"]), ("acc_active", "eq", "true")]
+        ).all()
+        self.assertEqual(len(customers), 2)
+
+    def test_find_by_filters_not_allowed(self):
+        """It should not Find Customers with unknown fields or operators"""
+        self.assertRaises(DataValidationError, Customer.build_filters, [("phone", "eq", "1")])
+        self.assertRaises(DataValidationError, Customer.build_filters, [("city", "like", "%")])
+        self.assertRaises(DataValidationError, Customer.build_filters, [("acc_active", "prefix", "t")])
+        self.assertRaises(DataValidationError, Customer.build_filters, [("acc_active", "eq", "maybe")])
+
+    def test_search(self):
+        """It should Search Customers by name, email and city, best matches first"""
+        contains = CustomerFactory(firstname="Joanna", lastname="Brown", email="jb@example.com", city="Oslo")
+        exact = CustomerFactory(firstname="Ann", lastname="Lee", email="al@example.com", city="Rome")
+        prefix = CustomerFactory(firstname="Kim", lastname="Annan", email="ka@example.com", city="Lima")
+        other = CustomerFactory(firstname="Bo", lastname="Ng", email="bn@example.com", city="Annapolis")
+        CustomerFactory(firstname="Li", lastname="Wu", email="lw@example.com", city="Turin").create()
+        for customer in (contains, exact, prefix, other):
+            customer.create()
+        results = Customer.search(" ANN ").all()
+        # prefix and other share a tier, which Postgres orders by similarity
+        self.assertEqual(results[0], exact)
+        self.assertEqual(set(results[1:3]), {prefix, other})
+        self.assertEqual(results[3], contains)
+        results = Customer.search("ann", limit=2).all()
+        self.assertEqual(results[0], exact)
+        self.assertIn(results[1], (prefix, other))
+        self.assertEqual(Customer.search("lw@EXAMPLE").all()[0].lastname, "Wu")
+        # a common text cannot crowd the exact and prefix matches out of the candidates
+        for number in range(4):
+            CustomerFactory(firstname="Joanne", lastname=f"Wolf{number}", city="Bern").create()
+        results = Customer.search("ann", limit=3, candidates=2).all()
+        self.assertEqual(results[0], exact)
+        self.assertEqual(set(results[1:]), {prefix, other})
+        # LIKE wildcards in the text are matched literally
+        self.assertEqual(Customer.search("a%n").all(), [])
+        self.assertEqual(Customer.search("_").all(), [])
+
+    def test_count(self):
+        """It should Count the Customers matching filters, exactly or estimated"""
+        for city in ("London", "London", "Paris"):
+            CustomerFactory(city=city).create()
+        self.assertEqual(Customer.count(), (3, True))
+        self.assertEqual(Customer.count([("city", "eq", "london")]), (2, True))
+        # Only Postgres estimates, other databases count exactly
+        self.assertEqual(Customer.count([("city", "eq", "paris")], estimate=True, exact_below=0), (1, True))
+
+    def test_estimate_statement(self):
+        """It should Estimate counts from the Postgres planner's statistics"""
+        dialect = postgresql.dialect()
+        self.assertIsNone(Customer.estimate_statement([], db.engine.dialect))
+        statement = str(Customer.estimate_statement([], dialect).compile(dialect=dialect))
+        self.assertIn("FROM pg_class", statement)
+        statement = Customer.estimate_statement([("state", "in", ["NY", "CA"])], dialect).compile(dialect=dialect)
+        self.assertTrue(str(statement).startswith("EXPLAIN (FORMAT JSON) SELECT customer.id"))
+        self.assertEqual(sorted(statement.params.values()), ["CA", "NY"])
+        self.assertEqual(Customer.read_estimate([{"Plan": {"Plan Rows": 1200}}]), 1200)
+        self.assertEqual(Customer.read_estimate('[{"Plan": {"Plan Rows": 1200}}]'), 1200)
+        self.assertEqual(Customer.read_estimate(-1.0), 0)
+        self.assertEqual(Customer.read_estimate(52000.0), 52000)
+
+    def test_update_columns(self):
+        """It should Update some columns of a Customer in one statement"""
+        customer = CustomerFactory(acc_active=True)
+        customer.create()
+        version = customer.version
+        Customer.find_cached(customer.id)
+        row = Customer.update_columns(customer.id, {"acc_active": False})
+        self.assertEqual(row.id, customer.id)
+        self.assertFalse(row.acc_active)
+        self.assertEqual(row.version, version + 1)
+        self.assertEqual(Customer.cache.stats()["size"], 0)
+        self.assertIsNone(Customer.update_columns(0, {"acc_active": False}))
+        self.assertIsNone(Customer.update_columns(customer.id, {"acc_active": True}, [version]))
+        row = Customer.update_columns(customer.id, {"acc_active": True}, [version + 1])
+        self.assertEqual(row.version, version + 2)
+
+    def test_partial_values(self):
+        """It should validate and normalize only the fields of a partial update"""
+        self.assertEqual(
+            Customer.partial_values({"email": "A@B.COM", "lastname": "o'neil", "phone": "555", "acc_active": "no"}),
+            {"email": "a@b.com", "lastname": "O'Neil", "phone": "555", "acc_active": False},
+        )
+        for data in ([], {}, {"id": 1}, {"created_at": "2022-01-01"}, {"city": 3}, {"email": None}):
+            self.assertRaises(DataValidationError, Customer.partial_values, data)
+
+    def test_set_active_many(self):
+        """It should Deactivate many Customers by id or by filter"""
+        london = [CustomerFactory(city="London", acc_active=True) for _ in range(3)]
+        paris = CustomerFactory(city="Paris", acc_active=True)
+        for customer in london + [paris]:
+            customer.create()
+        Customer.find_cached(london[0].id)
+        self.assertEqual(Customer.set_active_many(False, ids=[london[0].id, 0]), 1)
+        # the cached copy was dropped with the rest of the cache
+        self.assertIsNone(Customer.cache.get(str(london[0].id)))
+        self.assertEqual(Customer.set_active_many(False, criteria=[("city", "eq", "london")]), 3)
+        self.assertEqual(Customer.find_by_filters([("acc_active", "eq", "false")]).count(), 3)
+        self.assertTrue(Customer.find(paris.id).acc_active)
+        self.assertRaises(DataValidationError, Customer.set_active_many, False)
+
+    def test_find_many_cached(self):
+        """It should read many Customers in order through the cache with one query"""
+        customers = [CustomerFactory() for _ in range(3)]
+        for customer in customers:
+            customer.create()
+        Customer.find_cached(customers[1].id)
+        ids = [customers[2].id, 0, customers[1].id, customers[0].id, customers[2].id]
+        entries = Customer.find_many_cached(ids)
+        self.assertIsNone(entries[1])
+        self.assertEqual(
+            [etag for etag, _ in entries[:1] + entries[2:]],
+            [customers[2].etag, customers[1].etag, customers[0].etag, customers[2].etag],
+        )
+        self.assertEqual(json.loads(entries[3][1])["email"], customers[0].email)
+        # the Customers that were read are cached for single reads too
+        hits = Customer.cache.stats()["hits"]
+        Customer.find_cached(customers[0].id)
+        self.assertEqual(Customer.cache.stats()["hits"], hits + 1)
+        self.assertEqual(Customer.find_many_cached([]), [])
+
+    def test_find_cached(self):
+        """It should read a Customer through the cache and invalidate it on writes"""
+        customer = CustomerFactory()
+        customer.create()
+        misses = Customer.cache.stats()["misses"]
+        etag, body = Customer.find_cached(customer.id)
+        self.assertEqual(etag, customer.etag)
+        self.assertEqual(json.loads(body)["email"], customer.email)
+        self.assertEqual(Customer.cache.stats()["misses"], misses + 1)
+        self.assertEqual(Customer.find_cached(str(customer.id)), (etag, body))
+        customer.lastname = "Moreno"
+        customer.update()
+        self.assertEqual(json.loads(Customer.find_cached(customer.id)[1])["lastname"], "Moreno")
+        customer.delete()
+        self.assertIsNone(Customer.find_cached(customer.id))
+
+    def test_to_json(self):
+        """It should serialize a Customer straight to JSON like the API documents it"""
+        customer = CustomerFactory(firstname='Zoë "Zo"', acc_active=True)
+        customer.create()
+        data = json.loads(customer.to_json())
+        self.assertEqual(data["id"], str(customer.id))
+        self.assertEqual(data["firstname"], 'Zoë "Zo"')
+        self.assertIs(data["acc_active"], True)
+        self.assertEqual(data["created_at"], customer.created_at.isoformat())
+        self.assertNotIn("version", data)
+        for key, value in customer.serialize().items():
+            self.assertEqual(data[key], str(value) if key == "id" else value)
+
+    def test_parse_fields(self):
+        """It should validate sparse fieldsets and put them in field order"""
+        self.assertIsNone(Customer.parse_fields(None))
+        self.assertEqual(Customer.parse_fields("acc_active, email,id,email"), ("id", "email", "acc_active"))
+        self.assertRaises(DataValidationError, Customer.parse_fields, "")
+        self.assertRaises(DataValidationError, Customer.parse_fields, "id,version")
+        self.assertRaises(DataValidationError, Customer.parse_fields, "id,__class__")
+
+    def test_sparse_fieldsets(self):
+        """It should load and serialize only the columns of some fields"""
+        customer = CustomerFactory(acc_active=False)
+        customer.create()
+        fields = ("id", "email", "acc_active")
+        self.assertIs(Customer.serializer(fields), Customer.serializer(fields))
+        self.assertIs(Customer.serializer(), Customer.serializer(None))
+        db.session.expunge_all()
+        with metrics.capture_queries() as statements:
+            found = Customer.load_fields(Customer.find_by_filters([]), fields).all()
+        self.assertNotIn("street_line1", statements[0])
+        data = json.loads(Customer.serializer(fields)(found[0]))
+        self.assertEqual(data, {"id": str(customer.id), "email": customer.email, "acc_active": False})
+
+        with metrics.capture_queries() as statements:
+            etag, body = Customer.find_fields(customer.id, ("email",))
+        self.assertNotIn("street_line1", statements[0])
+        self.assertEqual(etag, customer.etag)
+        self.assertEqual(json.loads(body), {"email": customer.email})
+        self.assertIsNone(Customer.find_fields(0, ("email",)))
+
+
+######################################################################
+#  C U S T O M E R   C A C H E   T E S T   C A S E S
+######################################################################
+
+
+class TestCustomerCache(unittest.TestCase):
+    """ Test Cases for the Customer cache """
+
+    def setUp(self):
+        self.now = 0.0
+        self.cache = CustomerCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def test_lru_eviction(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.set("1", {"id": 1})
+        self.cache.set("2", {"id": 2})
+        self.assertEqual(self.cache.get("1"), {"id": 1})
+        self.cache.set("3", {"id": 3})
+        self.assertIsNone(self.cache.get("2"))
+        self.assertEqual(self.cache.get("1"), {"id": 1})
+        self.assertEqual(self.cache.get("3"), {"id": 3})
+        self.assertEqual(
+            self.cache.stats(), {"hits": 3, "misses": 1, "evictions": 1, "size": 2}
+        )
+
+    def test_ttl_expiry(self):
+        """It should not return entries older than the ttl"""
+        self.cache.set("1", {"id": 1})
+        self.now = 9.9
+        self.assertIsNotNone(self.cache.get("1"))
+        self.now = 10.0
+        self.assertIsNone(self.cache.get("1"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_delete_and_clear(self):
+        """It should remove entries on delete and clear"""
+        self.cache.set("1", {"id": 1})
+        self.cache.set("2", {"id": 2})
+        self.cache.delete("1")
+        self.assertIsNone(self.cache.get("1"))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("2"))
+
+    def test_disabled(self):
+        """It should not cache anything when the size is zero"""
+        cache = CustomerCache(max_size=0)
+        cache.set("1", {"id": 1})
+        self.assertIsNone(cache.get("1"))
@@ -6,14 +6,16 @@ Test cases can be run with the following:
   coverage report -m
 """
 # from email.mime import application
-# import json
 # import os
+import gzip
+import json
 import logging
+from contextlib import contextmanager
 from unittest import TestCase
-# from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 from service import app
-from service.models import Customer, db
-from service.common import status
+from service.models import Customer, db, supports_returning
+from service.common import metrics, status
 from tests.factories import CustomerFactory  # HTTP Status Codes
 from urllib.parse import quote_plus
 
@@ -30,17 +32,20 @@ class TestYourResourceServer(TestCase):
     @classmethod
     def setUpClass(cls):
         """ This runs once before the entire test suite """
-        pass
+        cls.context = app.app_context()
+        cls.context.push()
+        Customer.create_schema(app)
 
     @classmethod
     def tearDownClass(cls):
         """ This runs once after the entire test suite """
-        pass
+        cls.context.pop()
 
     def setUp(self):
         """ This runs before each test """
         db.session.query(Customer).delete()  # clean up the last tests
         db.session.commit()
+        Customer.cache.clear()
         self.app = app.test_client()
 
     def tearDown(self):
@@ -65,6 +70,16 @@ class TestYourResourceServer(TestCase):
             customers.append(test_customer)
         return customers
 
+    @contextmanager
+    def assert_query_budget(self, budget):
+        """Fails if the block runs more than budget SQL statements"""
+        with metrics.capture_queries() as statements:
+            yield
+        self.assertLessEqual(
+            len(statements), budget,
+            f"{len(statements)} queries over a budget of {budget}:\n" + "\n".join(statements),
+        )
+
     ######################################################################
     # T E S T   C R U D  E N D P O I N T S
     ######################################################################
@@ -76,6 +91,26 @@ class TestYourResourceServer(TestCase):
         data = response.get_json()
         self.assertEqual(data["status"], "OK")
 
+    def test_metrics(self):
+        """It should report per-resource request and SQL metrics"""
+        customer = self._create_customers(1)[0]
+        with self.assertLogs(app.logger, "DEBUG") as logs:
+            self.app.get(f"{BASE_URL}/{customer.id}")
+        # the per-request summary is only logged at DEBUG level
+        summary = [record for record in logs.records if "after 1 queries" in record.getMessage()]
+        self.assertEqual([record.levelno for record in summary], [logging.DEBUG])
+        self.assertIsNone(metrics.request_stats())
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.get_data(as_text=True)
+        self.assertIn('customers_http_requests_total{resource="CustomerResource.get",status="200"}', text)
+        self.assertIn('customers_http_request_duration_seconds_bucket{le="0.005",resource="CustomerCollection.post"}', text)
+        self.assertIn('customers_db_queries_per_request_count{resource="CustomerCollection.post"}', text)
+        self.assertIn('customers_http_response_size_bytes_count{resource="CustomerResource.get"}', text)
+        self.assertIn("customers_cache_hits{", text)
+        self.assertIn("customers_db_pool_checkouts{", text)
+
     ######################################################################
     #  C U S T O M E R S   T E S T   C A S E S
     ######################################################################
@@ -93,6 +128,148 @@ class TestYourResourceServer(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 5)
 
+    def test_get_customer_list_compressed(self):
+        """It should gzip large lists for clients that accept it"""
+        self._create_customers(5)
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(len(json.loads(gzip.decompress(resp.data))), 5)
+
+    def test_get_customer_list_with_fields(self):
+        """It should return only the requested fields of the Customers"""
+        customers = self._create_customers(2)
+        with metrics.capture_queries() as statements:
+            resp = self.app.get(BASE_URL, query_string={"fields": "id,email,acc_active"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            resp.get_json(),
+            [{"id": str(c.id), "email": c.email, "acc_active": True} for c in customers],
+        )
+        self.assertNotIn("street_line1", statements[0])
+        resp = self.app.get(BASE_URL, query_string={"fields": "email", "stream": "true"})
+        self.assertEqual([json.loads(line) for line in resp.data.splitlines()], [{"email": c.email} for c in customers])
+        resp = self.app.get(BASE_URL, query_string={"fields": "email,password"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_customer_with_fields(self):
+        """It should return only the requested fields of a Customer with a weak ETag"""
+        customer = self._create_customers(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{customer.id}", query_string={"fields": "email,id"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"id": str(customer.id), "email": customer.email})
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+        resp = self.app.get(
+            f"{BASE_URL}/{customer.id}", query_string={"fields": "email"}, headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.app.get(f"{BASE_URL}/0", query_string={"fields": "email"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get(f"{BASE_URL}/{customer.id}", query_string={"fields": "version"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_customer_list_with_count(self):
+        """It should send the number of matching Customers in X-Total-Count"""
+        customers = self._create_customers(3)
+        resp = self.app.get(BASE_URL, query_string={"limit": 1, "count": "exact"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 1)
+        self.assertEqual(resp.headers["X-Total-Count"], "3")
+        resp = self.app.get(BASE_URL, query_string={"email": customers[0].email, "count": "estimated"})
+        self.assertEqual(resp.headers["X-Total-Count"], "1")
+        self.assertNotIn("X-Total-Count-Estimated", resp.headers)
+        resp = self.app.get(BASE_URL)
+        self.assertNotIn("X-Total-Count", resp.headers)
+        resp = self.app.get(BASE_URL, query_string={"count": "roughly"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_count_customers(self):
+        """It should count Customers with HEAD without sending them"""
+        customers = self._create_customers(3)
+        resp = self.app.head(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["X-Total-Count"], "3")
+        self.assertEqual(resp.data, b"")
+        resp = self.app.head(BASE_URL, query_string={"lastname": customers[1].lastname, "count": "exact"})
+        self.assertEqual(
+            resp.headers["X-Total-Count"], str(sum(c.lastname == customers[1].lastname for c in customers))
+        )
+        resp = self.app.head(BASE_URL, query_string={"count": "none"})
+        self.assertNotIn("X-Total-Count", resp.headers)
+
+    def test_count_customers_estimated(self):
+        """It should send large estimated counts as estimates"""
+        estimate = db.text("SELECT 50000")
+        with patch.object(Customer, "estimate_statement", return_value=estimate):
+            resp = self.app.head(BASE_URL)
+            self.assertEqual(resp.headers["X-Total-Count"], "50000")
+            self.assertEqual(resp.headers["X-Total-Count-Estimated"], "true")
+            resp = self.app.head(BASE_URL, query_string={"count": "exact"})
+            self.assertEqual(resp.headers["X-Total-Count"], "0")
+            self.assertNotIn("X-Total-Count-Estimated", resp.headers)
+
+    def test_get_customer_list_paginated(self):
+        """It should page through the list of Customers with Link headers"""
+        customers = self._create_customers(5)
+        seen = []
+        url = f"{BASE_URL}?limit=2"
+        while url:
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = resp.get_json()
+            self.assertLessEqual(len(data), 2)
+            seen.extend(customer["id"] for customer in data)
+            link = resp.headers.get("Link")
+            url = None
+            if link:
+                self.assertIn('rel="next"', link)
+                url = link[link.index("<") + 1:link.index(">")]
+        self.assertEqual(sorted(seen, key=int), sorted((str(c.id) for c in customers), key=int))
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_get_customer_list_last_page_has_no_link(self):
+        """It should not send a next Link when all Customers fit on one page"""
+        self._create_customers(2)
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+        self.assertIsNone(resp.headers.get("Link"))
+
+    def test_get_customer_list_bad_pagination(self):
+        """It should not List Customers with a bad limit or cursor"""
+        resp = self.app.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL, query_string="cursor=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_customer_list(self):
+        """It should stream every Customer as NDJSON with stream=1"""
+        customers = self._create_customers(3)
+        resp = self.app.get(BASE_URL, query_string="stream=1&limit=1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_data(as_text=True).splitlines()), 1)
+        resp = self.app.get(BASE_URL, query_string="stream=1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        data = [json.loads(line) for line in lines]
+        self.assertEqual([row["id"] for row in data], [str(customer.id) for customer in customers])
+
+    def test_stream_customer_list_by_accept_header(self):
+        """It should stream filtered Customers when NDJSON is accepted"""
+        customer = self._create_customers(2)[0]
+        resp = self.app.get(
+            BASE_URL,
+            query_string=f"email={quote_plus(customer.email)}",
+            headers={"Accept": "application/x-ndjson"},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["email"], customer.email)
+
     def test_create_customer(self):
         """ It should create a customer"""
         customer = CustomerFactory()
@@ -170,6 +347,14 @@ class TestYourResourceServer(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT, "Duplicate email used in customer create")
 
+    def test_update_customer_with_dupe_email(self):
+        """It should not Update a customer to use another customer's email address"""
+        customer_1, customer_2 = self._create_customers(2)
+        data = self.app.get(f"{BASE_URL}/{customer_2.id}").get_json()
+        data["email"] = customer_1.email.upper()
+        resp = self.app.put(f"{BASE_URL}/{customer_2.id}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
     def test_bad_request(self):
         """It should not Create when sending the wrong data"""
         resp = self.app.post(BASE_URL, json={"name": "not enough data"})
@@ -213,6 +398,74 @@ class TestYourResourceServer(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
 
+    def test_get_customer_after_update(self):
+        """It should not Read a stale cached customer after it is updated"""
+        customer = self._create_customers(1)[0]
+        data = self.app.get(f"{BASE_URL}/{customer.id}").get_json()
+        data["phone"] = "+15550001111"
+        resp = self.app.put(f"{BASE_URL}/{customer.id}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.get_json()["phone"], "+15550001111")
+        self.app.delete(f"{BASE_URL}/{customer.id}")
+        resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_customer_etag(self):
+        """It should answer If-None-Match with 304 until the customer changes"""
+        customer = self._create_customers(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+        resp = self.app.get(f"{BASE_URL}/{customer.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.get_data(), b"")
+        data = self.app.get(f"{BASE_URL}/{customer.id}").get_json()
+        data["phone"] = "+15550001111"
+        resp = self.app.put(f"{BASE_URL}/{customer.id}", json=data)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        resp = self.app.get(f"{BASE_URL}/{customer.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_update_customer_if_match(self):
+        """It should only Update a customer whose ETag matches If-Match"""
+        customer = self._create_customers(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+        data["phone"] = "+15550001111"
+        resp = self.app.put(f"{BASE_URL}/{customer.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # the first writer bumped the version so a second one with the old ETag loses
+        data["phone"] = "+15550002222"
+        resp = self.app.put(f"{BASE_URL}/{customer.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.get_json()["phone"], "+15550001111")
+
+    def test_delete_customer_if_match(self):
+        """It should only Delete a customer whose ETag matches If-Match"""
+        customer = self._create_customers(1)[0]
+        etag = self.app.get(f"{BASE_URL}/{customer.id}").headers["ETag"]
+        resp = self.app.delete(f"{BASE_URL}/{customer.id}", headers={"If-Match": '"0-0"'})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.delete(f"{BASE_URL}/{customer.id}", headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_customer_by_id_alias(self):
+        """It should share the cache between spellings of an id and reject non ids"""
+        customer = self._create_customers(1)[0]
+        resp = self.app.get(f"{BASE_URL}/0{customer.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.patch(f"{BASE_URL}/{customer.id}", json={"city": "Oslo"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.app.get(f"{BASE_URL}/0{customer.id}").get_json()["city"], "Oslo")
+        for customer_id in ("abc", "-1", "\u00b2", "99999999999"):
+            resp = self.app.get(f"{BASE_URL}/{customer_id}")
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND, customer_id)
+
     def test_get_customer_not_found(self):
         """It should not Read a Customer that is not found"""
         resp = self.app.get(f"{BASE_URL}/0")
@@ -248,7 +501,7 @@ class TestYourResourceServer(TestCase):
 
         updated_customer = resp.get_json()
         self.assertEqual(
-            updated_customer["firstname"], new_customer["firstname"], "First names do not match"
+            updated_customer["firstname"], "Something-Wicked", "First names do not match"
         )
         self.assertEqual(
             updated_customer["lastname"], new_customer["lastname"], "Last names do not match"
@@ -279,12 +532,71 @@ class TestYourResourceServer(TestCase):
         self.assertEqual(
             updated_customer["zipcode"], new_customer["zipcode"], "Zipcode does not match"
         )
+        # the normalized first name is found by lookups
+        resp = self.app.get(BASE_URL, query_string={"firstname": "something-wicked"})
+        self.assertEqual([c["id"] for c in resp.get_json()], [new_customer_id])
 
     def test_update_customer_not_found(self):
         """It should get error code 404 when trying to update a customer that does not exist"""
         resp = self.app.put(f"{BASE_URL}/0", json={"not": "today"})
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_patch_customer(self):
+        """It should Update only the fields sent in a PATCH, normalized like a create"""
+        customer = self._create_customers(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        original = resp.get_json()
+        original_version = int(resp.headers["ETag"].strip('"').split("-")[1])
+        resp = self.app.patch(
+            f"{BASE_URL}/{customer.id}",
+            json={"email": "New.Address@Example.COM", "city": "new york", "acc_active": "false"},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        patched = resp.get_json()
+        self.assertEqual(patched["email"], "new.address@example.com")
+        self.assertEqual(patched["city"], "New York")
+        self.assertFalse(patched["acc_active"])
+        for field in ("firstname", "lastname", "phone", "street_line1", "zipcode"):
+            self.assertEqual(patched[field], original[field])
+        self.assertEqual(resp.headers["ETag"], f'"{customer.id}-{original_version + 1}"')
+        # the cached Customer was replaced
+        resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        self.assertEqual(resp.get_json(), patched)
+
+    def test_patch_customer_bad_request(self):
+        """It should not PATCH with an empty body, unknown fields or wrong types"""
+        customer = self._create_customers(1)[0]
+        for body in ({}, [], {"id": "7"}, {"nickname": "Al"}, {"email": None}, {"acc_active": "maybe"}):
+            resp = self.app.patch(f"{BASE_URL}/{customer.id}", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def test_patch_customer_if_match(self):
+        """It should only PATCH a customer whose ETag matches If-Match"""
+        customer = self._create_customers(1)[0]
+        etag = self.app.get(f"{BASE_URL}/{customer.id}").headers["ETag"]
+        resp = self.app.patch(f"{BASE_URL}/{customer.id}", json={"phone": "+15550001111"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.patch(f"{BASE_URL}/{customer.id}", json={"phone": "+15550002222"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.patch(
+            f"{BASE_URL}/{customer.id}", json={"phone": "+15550002222"}, headers={"If-Match": f'"{customer.id}-\u00b2"'}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.patch(f"{BASE_URL}/0", json={"phone": "+15550002222"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.app.get(f"{BASE_URL}/{customer.id}").get_json()["phone"], "+15550001111")
+
+    def test_patch_customer_not_found(self):
+        """It should not PATCH a Customer that does not exist"""
+        resp = self.app.patch(f"{BASE_URL}/0", json={"phone": "+15550001111"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_patch_customer_with_dupe_email(self):
+        """It should not PATCH a customer to use another customer's email address"""
+        customer_1, customer_2 = self._create_customers(2)
+        resp = self.app.patch(f"{BASE_URL}/{customer_2.id}", json={"email": customer_1.email.upper()})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
     def test_get_customers_by_lastname(self):
         """It should return all customers with the same lastname"""
         lastname_to_use = "Merrick-Thirlway"
@@ -509,3 +821,230 @@ class TestYourResourceServer(TestCase):
         # check the data just to be sure
         for customer in data:
             self.assertEqual(customer["email"], email_to_use)
+
+    def test_get_customers_by_multiple_filters(self):
+        """It should return the customers matching every filter"""
+        customers = self._create_customers(3)
+        target = customers[0]
+        resp = self.app.get(
+            BASE_URL,
+            query_string={
+                "lastname": target.lastname,
+                "city": target.city,
+                "email__in": f"{target.email},{customers[1].email}",
+                "firstname__prefix": target.firstname[:2],
+                "acc_active": "true",
+            },
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["id"], str(target.id))
+
+    def test_get_customers_with_bad_filter_operator(self):
+        """It should not return customers for an unsupported filter operator"""
+        resp = self.app.get(BASE_URL, query_string="city__like=%25")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_customers(self):
+        """It should return the customers containing the search text, best matches first"""
+        ids = []
+        for number in range(3):
+            customer = CustomerFactory(email=f"search{number}@example.com")
+            ids.append(self.app.post(BASE_URL, json=customer.serialize()).get_json()["id"])
+        resp = self.app.get(f"{BASE_URL}/search", query_string={"q": "SEARCH1@"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["id"], ids[1])
+        # every email matches in the same tier, so only which Customers come back is fixed
+        resp = self.app.get(f"{BASE_URL}/search", query_string={"q": "@example.com"})
+        self.assertEqual({customer["id"] for customer in resp.get_json()}, set(ids))
+        resp = self.app.get(f"{BASE_URL}/search", query_string={"q": "@example.com", "limit": 2})
+        found = [customer["id"] for customer in resp.get_json()]
+        self.assertEqual(len(found), 2)
+        self.assertLess(set(found), set(ids))
+
+    def test_search_customers_bad_request(self):
+        """It should not search for missing or short text or with a bad limit"""
+        for query_string in ({}, {"q": " a "}, {"q": "an"}, {"q": "ann", "limit": 0}, {"q": "ann", "limit": 1000}):
+            resp = self.app.get(f"{BASE_URL}/search", query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query_string)
+
+    def test_bulk_create_customers(self):
+        """It should create many customers and report a status for each one"""
+        existing = self._create_customers(1)[0]
+        new_1 = CustomerFactory().serialize()
+        new_2 = CustomerFactory().serialize()
+        taken = CustomerFactory().serialize()
+        taken["email"] = existing.email.upper()
+        repeated = CustomerFactory().serialize()
+        repeated["email"] = new_1["email"]
+        payload = [new_1, {"firstname": "not enough data"}, taken, new_2, repeated]
+        resp = self.app.post(f"{BASE_URL}/bulk", json=payload)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(
+            [item["status"] for item in data],
+            [
+                status.HTTP_201_CREATED,
+                status.HTTP_400_BAD_REQUEST,
+                status.HTTP_409_CONFLICT,
+                status.HTTP_201_CREATED,
+                status.HTTP_409_CONFLICT,
+            ],
+        )
+        resp = self.app.get(data[3]["location"])
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["email"], new_2["email"].lower())
+        # ids are strings, as in every other response
+        self.assertEqual(resp.get_json()["id"], data[3]["id"])
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 3)
+
+    def test_bulk_create_customers_bad_request(self):
+        """It should not bulk create customers from a non-array or an oversized array"""
+        resp = self.app.post(f"{BASE_URL}/bulk", json={"not": "a list"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        max_items = app.config["BULK_MAX_ITEMS"]
+        app.config["BULK_MAX_ITEMS"] = 1
+        try:
+            payload = [CustomerFactory().serialize() for _ in range(2)]
+            resp = self.app.post(f"{BASE_URL}/bulk", json=payload)
+        finally:
+            app.config["BULK_MAX_ITEMS"] = max_items
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_bulk_deactivate_and_activate_customers(self):
+        """It should deactivate and activate many customers by id or by filter"""
+        customers = self._create_customers(3)
+        ids = [customer.id for customer in customers]
+        resp = self.app.delete(f"{BASE_URL}/active", json={"ids": ids[:2]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"affected": 2})
+        resp = self.app.get(BASE_URL, query_string={"acc_active": "false"})
+        self.assertEqual(sorted(c["id"] for c in resp.get_json()), sorted(ids[:2]))
+
+        city = customers[0].city
+        resp = self.app.put(f"{BASE_URL}/active", json={"filters": {"city": city, "acc_active": "false"}})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"affected": 1})
+        resp = self.app.get(f"{BASE_URL}/{ids[0]}")
+        self.assertTrue(resp.get_json()["acc_active"])
+
+    def test_bulk_activate_customers_bad_request(self):
+        """It should not change many customers without ids or with unknown filters"""
+        for payload in ({}, {"ids": ["one"]}, {"filters": ["city"]}, {"filters": {"phone": "1"}}):
+            resp = self.app.put(f"{BASE_URL}/active", json=payload)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, payload)
+
+    def test_bulk_delete_customers(self):
+        """It should delete many customers in batches and ignore unknown ids"""
+        customers = self._create_customers(3)
+        ids = [customer.id for customer in customers[:2]] + ["0"]
+        batch_size = app.config["BULK_DELETE_BATCH_SIZE"]
+        app.config["BULK_DELETE_BATCH_SIZE"] = 2
+        try:
+            resp = self.app.delete(f"{BASE_URL}/bulk", json={"ids": ids})
+        finally:
+            app.config["BULK_DELETE_BATCH_SIZE"] = batch_size
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual([c["id"] for c in self.app.get(BASE_URL).get_json()], [customers[2].id])
+        resp = self.app.delete(f"{BASE_URL}/bulk", json={"ids": ids})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.delete(f"{BASE_URL}/bulk", json=ids)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_multi_get_customers(self):
+        """It should read many customers in the order posted, marking the missing ones"""
+        customers = self._create_customers(2)
+        ids = [customers[1].id, "0", customers[0].id]
+        resp = self.app.post(f"{BASE_URL}/_mget", json={"ids": ids})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()
+        self.assertEqual([result["id"] for result in results], [str(customer_id) for customer_id in ids])
+        self.assertEqual([result["found"] for result in results], [True, False, True])
+        self.assertNotIn("customer", results[1])
+        self.assertEqual(results[0]["customer"], self.app.get(f"{BASE_URL}/{customers[1].id}").get_json())
+        self.assertEqual(results[2]["customer"]["email"], customers[0].email)
+
+    def test_multi_get_customers_bad_request(self):
+        """It should not read many customers without a valid list of ids"""
+        for payload in ([1], {}, {"ids": "1,2"}, {"ids": ["one"]}, {"ids": ["\u00b2"]}, {"ids": [""]}):
+            resp = self.app.post(f"{BASE_URL}/_mget", json=payload)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, payload)
+        resp = self.app.post(f"{BASE_URL}/_mget", json={"ids": list(range(app.config["BULK_MAX_ITEMS"] + 1))})
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_query_budgets(self):
+        """It should keep every endpoint within its SQL query budget"""
+        # Without RETURNING server generated columns are read back with a SELECT
+        read_back = 0 if supports_returning() else 1
+        with self.assert_query_budget(1 + read_back):
+            resp = self.app.post(BASE_URL, json=CustomerFactory(acc_active=True).serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        customer = resp.get_json()
+        # a bulk create costs the same number of statements whatever its size
+        for size in (2, 20):
+            with self.assert_query_budget(2 + read_back):
+                resp = self.app.post(f"{BASE_URL}/bulk", json=[CustomerFactory().serialize() for _ in range(size)])
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual([item["status"] for item in resp.get_json()], [status.HTTP_201_CREATED] * size)
+        Customer.cache.clear()
+        with self.assert_query_budget(1):
+            resp = self.app.get(f"{BASE_URL}/{customer['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(0):
+            resp = self.app.get(f"{BASE_URL}/{customer['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(1):
+            resp = self.app.get(BASE_URL, query_string={"city": customer["city"]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(1):
+            resp = self.app.get(f"{BASE_URL}/search", query_string={"q": customer["city"]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn(customer["id"], [found["id"] for found in resp.get_json()])
+        with self.assert_query_budget(1):
+            resp = self.app.head(BASE_URL, query_string={"city": customer["city"]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(2):
+            resp = self.app.get(BASE_URL, query_string={"city": customer["city"], "count": "exact"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        Customer.cache.clear()
+        with self.assert_query_budget(1):
+            resp = self.app.post(f"{BASE_URL}/_mget", json={"ids": [customer["id"], 0, customer["id"]]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(1):
+            resp = self.app.post(f"{BASE_URL}/_mget", json={"ids": [0]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(0):
+            resp = self.app.post(f"{BASE_URL}/_mget", json={"ids": [customer["id"]]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(2 + read_back):
+            resp = self.app.put(f"{BASE_URL}/{customer['id']}", json=customer)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(1 + read_back):
+            resp = self.app.patch(f"{BASE_URL}/{customer['id']}", json={"city": "Boston"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(1 + read_back):
+            resp = self.app.delete(f"{BASE_URL}/{customer['id']}/active")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        with self.assert_query_budget(1):
+            resp = self.app.delete(f"{BASE_URL}/{customer['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_query_count_header_and_repeat_warning(self):
+        """It should report the query count in a header and warn about repeated statements"""
+        customer = self._create_customers(1)[0]
+        Customer.cache.clear()
+        settings = {"QUERY_COUNT_HEADER": app.config["QUERY_COUNT_HEADER"],
+                    "QUERY_REPEAT_WARNING": app.config["QUERY_REPEAT_WARNING"]}
+        app.config.update(QUERY_COUNT_HEADER=True, QUERY_REPEAT_WARNING=1)
+        try:
+            with self.assertLogs(app.logger, "WARNING") as logs:
+                resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        finally:
+            app.config.update(settings)
+        self.assertEqual(resp.headers["X-Query-Count"], "1")
+        self.assertIn("CustomerResource.get ran the same statement 1 times", logs.output[0])
+        resp = self.app.get(f"{BASE_URL}/{customer.id}")
+        self.assertNotIn("X-Query-Count", resp.headers)
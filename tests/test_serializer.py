@@ -0,0 +1,57 @@
+"""
+Test cases for the compiled JSON serializer
+"""
+import json
+from datetime import datetime
+from unittest import TestCase, skipUnless
+from service.common.serializer import available_backends, compile_serializer, json_array
+
+FIELDS = [("id", "str"), ("name", "str"), ("count", "int"), ("active", "bool"), ("seen", "datetime")]
+
+
+class TestSerializer(TestCase):
+    """Test the compiled serializers"""
+
+    def setUp(self):
+        self.record = {
+            "id": 7,
+            "name": 'Zoë "Zo"\n',
+            "count": 3,
+            "active": False,
+            "seen": datetime(2022, 11, 1, 12, 30),
+        }
+
+    def test_serialize_dictionary(self):
+        """It should serialize a dictionary in field order"""
+        serialize = compile_serializer(FIELDS, getter="item")
+        text = serialize(self.record)
+        self.assertTrue(text.startswith('{"id":"7","name":'))
+        self.assertEqual(
+            json.loads(text),
+            {"id": "7", "name": 'Zoë "Zo"\n', "count": 3, "active": False, "seen": "2022-11-01T12:30:00"},
+        )
+
+    def test_serialize_nulls(self):
+        """It should serialize None as null for every kind"""
+        serialize = compile_serializer(FIELDS, getter="item")
+        text = serialize(dict.fromkeys(self.record))
+        self.assertEqual(json.loads(text), dict.fromkeys(self.record))
+
+    def test_json_array(self):
+        """It should join serialized documents into an array"""
+        serialize = compile_serializer([("id", "int")], getter="item")
+        self.assertEqual(json_array(serialize({"id": n}) for n in range(3)), '[{"id":0},{"id":1},{"id":2}]')
+        self.assertEqual(json_array([]), "[]")
+
+    def test_bad_fields(self):
+        """It should not compile unknown kinds, unsafe names or missing backends"""
+        self.assertRaises(ValueError, compile_serializer, [("id", "decimal")])
+        self.assertRaises(ValueError, compile_serializer, [("id); import os; (", "str")])
+        self.assertRaises(ValueError, compile_serializer, [("id", "str")], backend="nope")
+
+    @skipUnless("orjson" in available_backends(), "orjson is not installed")
+    def test_orjson_backend(self):
+        """It should produce the same document with the orjson backend"""
+        builtin = compile_serializer(FIELDS, getter="item")
+        fast = compile_serializer(FIELDS, getter="item", backend="orjson")
+        self.assertEqual(json.loads(fast(self.record)), json.loads(builtin(self.record)))